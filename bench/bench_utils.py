@@ -0,0 +1,38 @@
+# bench脚本共用：把src加入sys.path、计时、构造测试数据
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+
+def per_second(fn, number: int) -> float:
+    """
+    连续调用fn number次，返回每秒调用次数
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return number / (time.perf_counter() - start)
+
+
+def init_models():
+    """
+    只初始化model元信息（不连库），之后才能构造model对象、调用to_dicts
+    """
+    from tortoise import Tortoise
+    Tortoise.init_models(['orm.model'], 'models')
+
+
+def order_page(size: int, **fields) -> list:
+    """
+    构造一页不入库的OrderModel，fields覆盖默认字段值
+    """
+    from orm.model import OrderModel
+
+    now = datetime.now()
+    defaults = dict(create_time=now, update_time=now, member_name='member', member_phone='13800000000',
+                    course_id=1, course_name='course', bill_type='count', limit_counts=10, surplus_counts=5,
+                    expire_time=now + timedelta(days=30), amount=1000, comments=[])
+    return [OrderModel(**{**defaults, **fields}, id=i, member_id=i, order_no=f'no{i}') for i in range(size)]
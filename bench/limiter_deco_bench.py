@@ -0,0 +1,63 @@
+# limiter_deco 单次调用开销：旧实现（每次调用都 get_module_func(func) 拼key）与现实现（装饰时缓存key）整体对比
+# 用法：python bench/limiter_deco_bench.py
+import timeit
+from functools import wraps
+
+import bench_utils  # noqa: F401  把src加入sys.path
+from infra.limiter import create_rate_limiter
+from infra.utils import limiter_deco, get_module_func, LimiterExceedError
+import infra.utils
+
+
+class _Request:
+    headers = {}
+
+
+def _identifier(request):
+    return 'openid'
+
+
+async def handler(request):
+    pass
+
+
+def old_limiter_deco(identifier_func, seconds: float = 2, capacity: int = 1,
+                     exceed_handle=LimiterExceedError("Too many requests, please try again.")):
+    """
+    改动前的实现，除了key的计算方式外与limiter_deco相同
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            key = identifier_func(request) + '@' + get_module_func(func)
+
+            if infra.utils.rate_limiter.acquire(key, seconds, capacity):
+                return func(request, *args, **kwargs)
+            else:
+                if callable(exceed_handle):
+                    return exceed_handle()
+                elif isinstance(exceed_handle, Exception):
+                    raise exceed_handle
+                else:
+                    return exceed_handle
+
+        return wrapper
+
+    return decorator
+
+
+def main(number: int = 20000):
+    # 两种实现都用内存后端；容量足够大，只测判断+调用本身的开销，不触发限流
+    infra.utils.rate_limiter = create_rate_limiter('memory')
+    request = _Request()
+    cases = (
+        ('old limiter_deco (per-call key)', old_limiter_deco(_identifier, seconds=1, capacity=number * 10)(handler)),
+        ('new limiter_deco (cached key)', limiter_deco(_identifier, seconds=1, capacity=number * 10)(handler)),
+    )
+    for name, decorated in cases:
+        seconds = min(timeit.repeat(lambda: decorated(request).close(), number=number, repeat=3))
+        print(f'{name:<32} {seconds / number * 1e6:8.2f} us/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# 大分页响应的编码开销：对比旧的 resp_success（dict.update + Sanic默认dumps）与 orjson 编码路径
+# 用法：python bench/resp_json_bench.py
+from datetime import datetime
+
+from sanic.response import json as sanic_json
+
+from bench_utils import init_models, order_page, per_second
+from common.const import CONST
+from infra.utils import resp_success, orjson
+
+init_models()
+
+from orm.model import OrderModel, UserModel  # noqa: E402
+
+
+def old_resp_success(resp_data: dict = None, **kwargs):
+    resp_data = resp_data or {}
+    result = {
+        CONST.MESSAGE: CONST.SUCCESS.lower()
+    }
+    result.update(resp_data)
+    result.update(kwargs)
+    return sanic_json(result)
+
+
+def _orders_page(size: int) -> dict:
+    objs = order_page(size, member_name='会员名', course_name='私教课',
+                      comments=[{'time': '2024-01-01 00:00:00', 'content': '备注'}])
+    return {'total': 1000, 'page': 1, 'size': size, 'pages': 1000 // size, 'items': OrderModel.to_dicts(objs)}
+
+
+def _users_page(size: int) -> dict:
+    now = datetime.now()
+    objs = [UserModel(id=i, create_time=now, update_time=now, openid=f'openid{i}', phone='13800000000', nickname='昵称',
+                      name_zh='姓名', avatar='https://example.com/avatar.png', subscribe_counts=3, staff_roles=[1],
+                      comments=[])
+            for i in range(size)]
+    return {'total': 1000, 'page': 1, 'size': size, 'pages': 1000 // size, 'items': UserModel.to_dicts(objs)}
+
+
+def main(page_size: int = 100, number: int = 2000):
+    print(f'encoder: {"orjson" if orjson else "stdlib json"}')
+    for page_name, page in (('find_orders', _orders_page(page_size)), ('find_users', _users_page(page_size))):
+        for name, fn in (('old resp_success', lambda: old_resp_success(page)),
+                         ('resp_success', lambda: resp_success(page))):
+            pages = per_second(fn, number)
+            print(f'{page_name:<12} {name:<18} {pages:10.0f} resp/s  {1e6 / pages:8.1f} us/resp ({page_size} rows)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# 整页序列化开销：对比旧的逐字段判断的 to_dict 与按model编译的序列化函数（to_dicts）
+# 用法：python bench/to_dict_bench.py
+from datetime import datetime
+from enum import Enum
+
+from bench_utils import init_models, order_page, per_second
+from infra.date_utils import get_date_str, get_date_time_str
+
+init_models()
+
+from orm.model import OrderModel  # noqa: E402
+
+
+def old_to_dict(self, *field) -> dict:
+    d = dict()
+    for c in field or self._meta.fields:
+        attr_name = c if isinstance(c, str) else c.name
+        value = getattr(self, attr_name)
+        if isinstance(value, datetime):
+            if attr_name == 'expire_time':
+                value = get_date_str(value)
+            else:
+                value = get_date_time_str(value)
+        if isinstance(value, Enum):
+            value = value.value
+        d[attr_name] = value
+    return d
+
+
+def main(page_size: int = 100, number: int = 2000):
+    objs = order_page(page_size)
+    assert OrderModel.to_dicts(objs) == [old_to_dict(obj) for obj in objs]
+
+    for name, fn in (('old to_dict', lambda: [old_to_dict(obj) for obj in objs]),
+                     ('compiled to_dicts', lambda: OrderModel.to_dicts(objs))):
+        pages = per_second(fn, number)
+        print(f'{name:<20} {pages:10.0f} pages/s  {1e6 / pages:8.1f} us/page ({page_size} OrderModel)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# service.validate_service 各schema每秒校验次数：jsonschema.validate()（旧实现，每次检查schema并新建validator）
+# 对比预编译validator（现实现）
+# 用法：python bench/validate_service_bench.py
+from jsonschema import validate
+
+from bench_utils import per_second
+from service import validate_service as vs
+
+SAMPLES = {
+    'userprofile_update_schema': {'nickname': 'nick', 'avatar': 'http://a/b.png', 'subscribe_incr': 1},
+    'user_update_schema': {'id': 1, 'staff_roles': [10], 'name_zh': '张三'},
+    'course_create_schema': {'name': '私教课', 'intro': '简介', 'thumbnail': 'http://a/b.png', 'bill_type': 'count',
+                             'limit_counts': 10, 'desc_images': ['http://a/c.png']},
+    'course_update_schema': {'id': 1, 'name': '私教课', 'bill_type': 'day', 'limit_days': 30},
+    'order_create_schema': {'member_id': 1, 'course_id': 1, 'amount': 100, 'receipt': 'http://a/b.png'},
+    'order_update_schema_first': {'id': 1, 'status': 'activated'},
+    'order_update_schema_part': {'course_id': 1, 'surplus_counts': 3, 'expire_time': '2024-08-26'},
+    'order_comment_create_schema': {'order_no': 'bFGP8SL7bqZtix9dkj9X4y', 'comment': '备注'},
+    'expense_update_schema': {'id': 1, 'status': 'activated'},
+    'expense_batch_update_schema': {'ids': list(range(1, 51)), 'status': 'reject'},
+    'qrcode_create_schema': {'scene': 'signin', 'uuid': 'owbV-xxxxxxxxxxxxxxxxxxxxxxx'},
+}
+
+
+def main(number: int = 2000, old_number: int = 100):
+    validate_data = getattr(vs, '__validate_data')
+    print(f'{"schema":<30} {"validate()/s":>14} {"compiled/s":>14}')
+    for name, data in SAMPLES.items():
+        schema = getattr(vs, name)
+        old = per_second(lambda: validate(data, schema), old_number)
+        new = per_second(lambda: validate_data(data, schema), number)
+        print(f'{name:<30} {old:>14,.0f} {new:>14,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,15 +3,33 @@ from functools import wraps
 from sanic.request import Request
 from tortoise.queryset import QuerySet
 
-from infra.utils import resp_failure, page_num_size
+from infra.utils import resp_failure, page_num_size, page_cursor, page_with_total
 
 
 async def paging(request: Request, query: QuerySet, order_by: tuple = ('-id',)) -> dict:
+    """
+    分页。默认按页码（page/size），带了after/before参数则按主键游标分页（仅支持默认的`-id`排序）
+    """
+    cursor_mode, after, before = page_cursor(request)
+    if cursor_mode and order_by == ('-id',):
+        return await cursor_paging(request, query, after, before)
+
     page_num, page_size = page_num_size(request)
 
+    if not page_with_total(request):
+        # 不统计总数，多取一条用来判断是否还有下一页
+        objs = await query.order_by(*order_by).offset(page_size * (page_num - 1)).limit(page_size + 1)
+        items = query.model.to_dicts(objs[:page_size])
+        return {
+            'page': page_num if items else 0,
+            'size': len(items),
+            'has_more': len(objs) > page_size,
+            'items': items
+        }
+
     count = await query.count()
     objs = await query.order_by(*order_by).offset(page_size * (page_num - 1)).limit(page_size)
-    items = [obj.to_dict() for obj in objs]
+    items = query.model.to_dicts(objs)
     return {
         'total': count,
         'page': page_num if count else 0,
@@ -22,6 +40,84 @@ async def paging(request: Request, query: QuerySet, order_by: tuple = ('-id',))
     }
 
 
+async def cursor_paging(request: Request, query: QuerySet, after: int = None, before: int = None) -> dict:
+    """
+    游标分页：按id倒序，after取更旧的一页（id < after），before取更新的一页（id > before），
+    走主键范围扫描，不受页数深度影响。返回的next/prev即下一次请求的after/before
+    """
+    _, page_size = page_num_size(request)
+
+    base_query = query
+    if before is not None:
+        objs = await query.filter(id__gt=before).order_by('id').limit(page_size + 1)
+        has_newer, has_older = len(objs) > page_size, True
+        objs = objs[:page_size][::-1]
+    else:
+        if after is not None:
+            query = query.filter(id__lt=after)
+        objs = await query.order_by('-id').limit(page_size + 1)
+        has_newer, has_older = after is not None, len(objs) > page_size
+        objs = objs[:page_size]
+
+    items = query.model.to_dicts(objs)
+    pagination = {
+        'size': len(items),
+        'next': str(objs[-1].id) if objs and has_older else None,
+        'prev': str(objs[0].id) if objs and has_newer else None,
+        'items': items
+    }
+    if page_with_total(request, default=False):
+        pagination['total'] = await base_query.count()
+    return pagination
+
+
+def list_paging(request: Request, items: list[dict]) -> dict:
+    """
+    对内存中已按id倒序排好的数据分页，参数和返回结构与paging()/cursor_paging()一致
+    """
+    cursor_mode, after, before = page_cursor(request)
+    page_num, page_size = page_num_size(request)
+
+    if cursor_mode:
+        if before is not None:
+            newer = [item for item in items if item['id'] > before]
+            page = newer[-page_size:]
+            has_newer, has_older = len(newer) > page_size, True
+        else:
+            older = items if after is None else [item for item in items if item['id'] < after]
+            page = older[:page_size]
+            has_newer, has_older = after is not None, len(older) > page_size
+        pagination = {
+            'size': len(page),
+            'next': str(page[-1]['id']) if page and has_older else None,
+            'prev': str(page[0]['id']) if page and has_newer else None,
+            'items': page
+        }
+        if page_with_total(request, default=False):
+            pagination['total'] = len(items)
+        return pagination
+
+    offset = page_size * (page_num - 1)
+    page = items[offset:offset + page_size]
+    if not page_with_total(request):
+        return {
+            'page': page_num if page else 0,
+            'size': len(page),
+            'has_more': len(items) > offset + page_size,
+            'items': page
+        }
+
+    count = len(items)
+    return {
+        'total': count,
+        'page': page_num if count else 0,
+        'size': len(page),
+        'pages': (1 if count else 0) if count <= page_size else (
+            count // page_size + 1 if count % page_size else count // page_size),
+        'items': page
+    }
+
+
 def check_staff(allowed_roles: list):
     def decorator(f):
         @wraps(f)
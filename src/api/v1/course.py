@@ -1,10 +1,12 @@
+from sanic.response import empty
 from sanic.views import HTTPMethodView
 
 from api import check_staff, check_authorize
 from common.const import CONST
 from common.enum import StaffRoleEnum, BillTypeEnum
-from infra.utils import resp_failure, resp_success, days_bill_description, limiter_deco, get_openid
-from orm.course_orm import find_courses
+from infra.date_utils import get_http_date_str
+from infra.utils import resp_failure, resp_success, days_bill_description, limiter_deco, get_openid, etag_matched
+from orm.course_orm import find_courses, get_course_catalogue, invalidate_course_catalogue
 from orm.model import CourseModel
 from service.validate_service import validate_course_create_data, validate_course_update_data
 
@@ -13,12 +15,20 @@ class Course(HTTPMethodView):
     @staticmethod
     async def get(request):
         """
-        查看所有课程
+        查看所有课程。走进程内的课程目录缓存，带ETag/Last-Modified，内容未变时返回304
         :param request:
         :return:
         """
-        # TODO 有暴刷风险
-        return resp_success(await find_courses(request))
+        catalogue = await get_course_catalogue()
+        headers = {'ETag': catalogue.etag(request.query_string), 'Cache-Control': 'no-cache'}
+        if catalogue.last_modified:
+            headers['Last-Modified'] = get_http_date_str(catalogue.last_modified)
+        if etag_matched(request, headers['ETag']):
+            return empty(status=304, headers=headers)
+
+        response = resp_success(find_courses(request, catalogue))
+        response.headers.update(headers)
+        return response
 
     @staticmethod
     @check_staff([StaffRoleEnum.MASTER.value, StaffRoleEnum.ADMIN.value])
@@ -41,6 +51,7 @@ class Course(HTTPMethodView):
             return resp_failure(400, f"课程名[{exists_course.name}]已经存在了")
 
         course: CourseModel = await CourseModel.create(**data)
+        invalidate_course_catalogue()
         return resp_success(id=course.id)
 
     @staticmethod
@@ -68,6 +79,7 @@ class Course(HTTPMethodView):
         #         return resp_failure(400, "教练不存在或未设置昵称")
 
         await CourseModel.update_one(data)
+        invalidate_course_catalogue()
         return resp_success()
 
     @staticmethod
@@ -79,6 +91,7 @@ class Course(HTTPMethodView):
         :return:
         """
         await CourseModel.delete_one(request.args.get(CONST.ID) or 0)
+        invalidate_course_catalogue()
         return resp_success()
 
 
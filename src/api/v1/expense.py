@@ -6,10 +6,10 @@ from sanic.views import HTTPMethodView
 from api import check_staff, check_authorize
 from common.const import CONST
 from common.enum import StaffRoleEnum, OrderStatusEnum, ExpenseStatusEnum
-from infra.utils import resp_failure, resp_success, str2base64
-from orm.expense_orm import find_expenses
-from orm.model import OrderModel, UserModel, ExpenseModel
-from service.validate_service import validate_expense_update_data, validate_order_expense_get_args
+from infra.utils import resp_failure, resp_success, str2base64, NotFoundError
+from orm.expense_orm import find_expenses, review_expenses
+from service.validate_service import validate_expense_update_data, validate_order_expense_get_args, \
+    validate_expense_batch_update_data
 
 
 class Expense(HTTPMethodView):
@@ -75,23 +75,29 @@ class Expense(HTTPMethodView):
         if not rst:
             return resp_failure(400, err_msg)
 
-        target_status: str = data.get(CONST.STATUS)
-        expense: ExpenseModel = await ExpenseModel.get_one(id=data.get(CONST.ID))
-        order: OrderModel = await OrderModel.get_one(order_no=expense.order_no)
+        reviewed_count = await review_expenses([data.get(CONST.ID)], data.get(CONST.STATUS))
+        if not reviewed_count:
+            raise NotFoundError(f"ExpenseModel[{data.get(CONST.ID)}] not found")
 
-        if target_status in [ExpenseStatusEnum.FREE.value, ExpenseStatusEnum.REJECT.value]:
-            if expense.status in [ExpenseStatusEnum.PENDING, ExpenseStatusEnum.ACTIVATED]:  # 返还课时
-                order.surplus_counts += 1
+        return resp_success()
 
-        if target_status == ExpenseStatusEnum.ACTIVATED.value:
-            if expense.status in [ExpenseStatusEnum.REJECT, ExpenseStatusEnum.FREE]:  # 扣除课时
-                order.surplus_counts -= 1
 
-        expense.status = target_status
-        await expense.save()
-        await order.save()
+class ExpenseBatch(HTTPMethodView):
+    @staticmethod
+    @check_staff([StaffRoleEnum.MASTER.value, StaffRoleEnum.ADMIN.value])
+    async def put(request):
+        """
+        店主/管理员批量审核核销（同一个事务）
+        :param request:
+        :return:
+        """
+        data = request.json or dict()
+        rst, err_msg = validate_expense_batch_update_data(data)
+        if not rst:
+            return resp_failure(400, err_msg)
 
-        return resp_success()
+        reviewed_count = await review_expenses(data.get(CONST.IDS), data.get(CONST.STATUS))
+        return resp_success(count=reviewed_count)
 
 
 # class ExpenseQrcode(HTTPMethodView):
@@ -2,10 +2,13 @@ from datetime import datetime, date
 
 import pytz
 from sanic.views import HTTPMethodView
+from tortoise import timezone
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
 
 from api import check_staff, check_authorize
 from common.enum import StaffRoleEnum, ScanSceneEnum, OrderStatusEnum, BillTypeEnum
-from infra.utils import resp_failure, resp_success, str2base64, limiter_deco, get_openid
+from infra.utils import resp_failure, resp_success, str2base64, limiter_deco, get_openid, ForbiddenError
 from orm.model import OrderModel, UserModel, ExpenseModel, SigninModel
 from service.validate_service import validate_qrcode_create_data
 
@@ -33,12 +36,14 @@ class Qrcode(HTTPMethodView):
         if sc == ScanSceneEnum.EXPENSE.value:
             order: OrderModel = await OrderModel.get_one(order_no=_id)
             member: UserModel = await UserModel.get_one(id=order.member_id)
-            assert member.id == request.ctx.user.id, f"OrderModel[{order.order_no}] no access for user[{request.ctx.user.id}]"
+            if member.id != request.ctx.user.id:
+                raise ForbiddenError(f"OrderModel[{order.order_no}] no access for user[{request.ctx.user.id}]")
         else:  # 签到
             member: UserModel = await UserModel.get_one(openid=_id)
-            assert member.id == request.ctx.user.id, f"OrderModel[{_id}] no access for user[{request.ctx.user.id}]"
+            if member.id != request.ctx.user.id:
+                raise ForbiddenError(f"OrderModel[{_id}] no access for user[{request.ctx.user.id}]")
 
-        return resp_success(qrcode=str2base64(qrcode_str))
+        return resp_success(qrcode=await str2base64(qrcode_str))
 
     @staticmethod
     @check_staff([StaffRoleEnum.COACH.value])
@@ -62,11 +67,6 @@ class Qrcode(HTTPMethodView):
             if order.bill_type != BillTypeEnum.COUNT:
                 return resp_failure(500, "此订单不支持核销")
 
-            # 判断订单状态是否activated、还在有效期、剩余次数大于零
-            if order.status != OrderStatusEnum.ACTIVATED or order.expire_time <= datetime.now(
-                    pytz.timezone('Asia/Shanghai')) or order.surplus_counts <= 0:
-                return resp_failure(500, "订单不可使用")
-
             # 组装数据
             data = dict(
                 member_id=order.member_id,
@@ -78,10 +78,19 @@ class Qrcode(HTTPMethodView):
                 course_name=order.course_name,
                 order_no=order.order_no,
             )
-            expense: ExpenseModel = await ExpenseModel.create(**data)
-            # 订单剩余次数减一
-            order.surplus_counts -= 1  # TODO 需要设置一天最多扫3次
-            await order.save()
+            async with in_transaction():
+                # 订单状态activated、还在有效期、剩余次数大于零才扣减一次，判断和扣减是同一条UPDATE，
+                # 并发扫码不会扣丢或扣成负数；事务里只有这条UPDATE和INSERT，行锁持有时间很短
+                modified_count = await OrderModel.filter(
+                    order_no=order.order_no,
+                    status=OrderStatusEnum.ACTIVATED.value,
+                    surplus_counts__gt=0,
+                    expire_time__gt=datetime.now(pytz.timezone('Asia/Shanghai'))
+                ).update(surplus_counts=F('surplus_counts') - 1, update_time=timezone.now())  # TODO 需要设置一天最多扫3次
+                if not modified_count:
+                    return resp_failure(500, "订单不可使用")
+
+                expense: ExpenseModel = await ExpenseModel.create(**data)
             return resp_success(scene=sc, id=expense.id)
         else:  # 签到
             member: UserModel = await UserModel.get_one(openid=_id)
@@ -70,7 +70,7 @@ class UserProfile(HTTPMethodView):
         :return:
         """
         data = request.json or dict()
-        rst, err_msg = validate_userprofile_update_data(data)
+        rst, err_msg = await validate_userprofile_update_data(data)
         if not rst:
             return resp_failure(400, err_msg)
 
@@ -96,7 +96,7 @@ class UserPhone(HTTPMethodView):
         if not code:
             return resp_failure(400, "缺少必要参数")
 
-        return resp_success(phone=phone_via_code(code))
+        return resp_success(phone=await phone_via_code(code))
 
 
 class UserOrder(HTTPMethodView):
@@ -1,70 +1,125 @@
+import asyncio
+import hmac
 import importlib
 import inspect
+import logging
 import pkgutil
+import random
 import re
+import time
 
 from sanic import Sanic
+from sanic.exceptions import RequestCancelled
 from sanic.handlers import ErrorHandler
 from sanic.request import Request
+from sanic.response import text
 from sanic.views import HTTPMethodView
 from tortoise.contrib.sanic import register_tortoise
 
 from common.const import CONST
-from infra.utils import resp_failure, camel2snake, get_openid, LimiterExceedError
-from loggers.logger import logger
-from orm.model import UserModel
+from infra.http_client import http_client
+from infra.metrics import metrics, flatten_stats
+from infra.query_stats import install_query_stats, start_query_stats, stop_query_stats
+from infra.utils import resp_failure, camel2snake, get_openid, ClientError, qrcode_renderer, retry_stats
+from loggers.logger import logger, client_error_log, log_queue_stats
+from orm.course_orm import course_catalogue_cache
+from orm.model import UserModel, user_identity_cache
 from scheduler.core import aps
+from scheduler.leader import SchedulerLeader
 from scheduler.tasks import run_tasks
 from settings.setting import SETTING
 
 app = Sanic(CONST.SYSTEM_APP_NAME)
 
+METRICS_PATH = f'{CONST.URL_PREFIX}/metrics'
+
 
 class _GlobalErrorHandler(ErrorHandler):
     def default(self, request, exc):
         """
         handles errors that have no error handlers assigned
         """
+        if isinstance(exc, ClientError):
+            # 可预期的客户端错误：一行限频日志，不格式化堆栈
+            client_error_log(exc.__class__.__name__, f"GlobalErrorHandler: {request.method} {request.path}, "
+                                                     f"{exc.__class__.__name__}<{str(exc)}>, {exc.status_code}")
+            return resp_failure(exc.status_code, exc.reason, print_log=False)
+
+        if isinstance(exc, RequestCancelled):
+            # 客户端在响应前断开，响应发不出去，只用于指标按499（client closed request）记录
+            client_error_log(exc.__class__.__name__, f"GlobalErrorHandler: {request.method} {request.path}, "
+                                                     f"client closed request, 499")
+            return resp_failure(499, "client closed request.", print_log=False)
+
         logger.exception(f"GlobalErrorHandler: {exc.__class__.__name__}<{str(exc)}>")
-        if isinstance(exc, AssertionError):
-            if "not found" in exc.args[-1]:
-                return resp_failure(404, "记录不存在")
-            if "no access" in exc.args[-1]:
-                return resp_failure(403, "您的权限不足以操作")
-        if isinstance(exc, LimiterExceedError):
-            return resp_failure(429, "操作太快啦，慢一点~")
 
         # You custom error handling logic...
         # return super().default(request, exc)
         return resp_failure(500, "哦豁，服务器开小差了~")
 
 
+def _request_log_msg(request: Request, user: UserModel = None) -> str:
+    """
+    请求日志内容，只在确定要输出时才拼接；body不解析JSON，按原始字节截断到LOG_BODY_MAX
+    """
+    if "multipart/form-data" in (request.headers.get('content-type') or ''):
+        body = "`multipart/form-data`"
+    else:
+        raw = request.body or b''
+        body = raw[:SETTING.LOG_BODY_MAX].decode(CONST.CODE_UTF8, 'replace')
+        if len(raw) > SETTING.LOG_BODY_MAX:
+            body += f'...({len(raw)} bytes)'
+
+    log_msg = f"{request.method} {request.path}"
+    if user is not None:
+        log_msg += f", user[name={user.nickname or user.name_zh or user.openid},role={user.staff_roles}]"
+    return log_msg + f", args:{request.args}, body:{body}"
+
+
+def _should_log_request(request: Request) -> bool:
+    if not logger.isEnabledFor(logging.INFO):
+        return False
+    if request.method.upper() != 'GET':
+        return True
+    # GET请求量大，按采样率记录
+    return SETTING.LOG_GET_SAMPLE_RATE > 0 and random.random() < SETTING.LOG_GET_SAMPLE_RATE
+
+
 @app.middleware("request")
-async def _before_request(request: Request):
-    try:
-        if "multipart/form-data" in request.headers.get('content-type'):
-            body = "`multipart/form-data`"
-        else:
-            body = request.json
-    except Exception:  # noqa
-        body = request.body
+async def _start_metrics(request: Request):
+    # 先于_before_request注册，耗时包含鉴权等中间件
+    request.ctx.metrics_route = request.route.path if request.route else 'unmatched'
+    request.ctx.start_time = time.perf_counter()
+    request.ctx.query_stats = start_query_stats()
+    metrics.request_started(request.ctx.metrics_route)
+    if request.conn_info is not None:
+        # 客户端提前断开时响应中间件不会执行，连接结束时由_finish_aborted_request补记
+        request.conn_info.ctx.metrics_request = request
 
-    log_msg = f"{request.method} {request.path}, args:{request.args}, body:{body}"
+
+@app.middleware("request")
+async def _before_request(request: Request):
     if not request.route:
-        logger.warning(log_msg + ", status_code 404.")
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(_request_log_msg(request) + ", status_code 404.")
         return resp_failure(404, f"路径不存在")
 
+    if request.path == METRICS_PATH:
+        if not _metrics_authorized(request):
+            return resp_failure(401, "invalid metrics token.")
+        return
+
     openid = get_openid(request)
     if not openid:
-        logger.warning(log_msg + ", status_code 400.")
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(_request_log_msg(request) + ", status_code 400.")
         return resp_failure(400, f"not found openid.")
 
-    user = await UserModel.get_or_none(openid=openid)
+    user = await UserModel.get_via_openid(openid)
     if not user:
         user = UserModel(id=-1, openid=openid)
-    user_info = f", user[name={user.nickname or user.name_zh or user.openid},role={user.staff_roles}], args:"
-    if request.method.upper() != 'GET':
-        logger.info(log_msg.replace(", args:", user_info))
+    if _should_log_request(request):
+        logger.info(_request_log_msg(request, user))
     request.ctx.user = user
 
 
@@ -74,15 +129,98 @@ async def _custom_header(request: Request, response):
     response.headers["Sanic-App-Version"] = "08030926"
 
 
+@app.middleware("response")
+async def _record_metrics(request: Request, response):
+    stats = _finish_request_metrics(request, response.status)
+    if stats is None:
+        return
+    if SETTING.DEV:
+        response.headers["X-DB-Queries"] = str(stats.count)
+        response.headers["X-DB-Time"] = f"{stats.seconds * 1000:.1f}ms"
+    if stats.count > SETTING.DB_QUERY_BUDGET:
+        fingerprints = '; '.join(f'[x{count}] {sql}' for sql, count in stats.fingerprints())
+        logger.warning(f"{request.method} {request.path} ran {stats.count} queries "
+                       f"({stats.seconds * 1000:.1f}ms), over budget {SETTING.DB_QUERY_BUDGET}: {fingerprints}")
+
+
+def _finish_request_metrics(request: Request, status: int):
+    """
+    记录请求耗时、状态码和SQL统计，在途数减一。每个请求只记一次，返回该请求的QueryStats
+    """
+    start_time = getattr(request.ctx, 'start_time', None)
+    if start_time is None:
+        return None
+    request.ctx.start_time = None
+    if request.conn_info is not None and getattr(request.conn_info.ctx, 'metrics_request', None) is request:
+        request.conn_info.ctx.metrics_request = None
+
+    route = request.ctx.metrics_route
+    metrics.request_finished(route, request.method, status, time.perf_counter() - start_time)
+    stats = request.ctx.query_stats
+    stop_query_stats()
+    metrics.request_queries(route, stats.count, stats.seconds)
+    return stats
+
+
+@app.signal("http.lifecycle.complete")
+async def _finish_aborted_request(conn_info):
+    # 连接结束时还有没记完的请求（客户端断开、处理被取消），按499（client closed request）记录，在途数不会一直偏高
+    request = getattr(conn_info.ctx, 'metrics_request', None)
+    if request is not None:
+        _finish_request_metrics(request, 499)
+
+
+def _metrics_authorized(request: Request) -> bool:
+    if not SETTING.METRICS_TOKEN:
+        return SETTING.DEV
+    return hmac.compare_digest(request.headers.get('authorization') or '', f'Bearer {SETTING.METRICS_TOKEN}')
+
+
+async def _metrics(request: Request):
+    """
+    Prometheus拉取入口：不校验openid，需带`Authorization: Bearer <METRICS_TOKEN>`；
+    没配置METRICS_TOKEN时只在DEV模式下开放
+    """
+    return text(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def register_metrics():
+    metrics.add_collector('qrcode', lambda: flatten_stats('qrcode', qrcode_renderer.stats()))
+    metrics.add_collector('user_cache', lambda: flatten_stats('user_cache', user_identity_cache.stats()))
+    metrics.add_collector('course_cache', lambda: flatten_stats('course_cache', course_catalogue_cache.stats()))
+    metrics.add_collector('log_queue', lambda: flatten_stats('log_queue', log_queue_stats()))
+    metrics.add_collector('retry', lambda: ((f'retry_{k}_total', {'name': name}, v)
+                                            for name, stats in retry_stats.items() for k, v in stats.items()))
+    if not SETTING.METRICS_TOKEN and not SETTING.DEV:
+        return
+    app.add_route(_metrics, METRICS_PATH, methods=['GET'])
+    logger.info(f"routes: {METRICS_PATH}, [GET]")
+
+
+async def _start_scheduler():
+    aps.run(asyncio.get_running_loop())
+    await run_tasks()
+
+
+async def _stop_scheduler():
+    await aps.stop()
+
+
 @app.listener("before_server_start")
 async def _before_server_start(app, loop):
-    aps.run(loop)
-    await run_tasks()
+    # 每个worker都会执行，定时任务只在抢到leader锁的worker里启动
+    app.ctx.scheduler_leader = SchedulerLeader(
+        mysql_credentials(), CONST.SCHEDULER_LOCK, interval=SETTING.SCHEDULER_LEADER_INTERVAL,
+        on_elected=_start_scheduler, on_demoted=_stop_scheduler)
+    app.ctx.scheduler_leader.start()
+    qrcode_renderer.start()
 
 
 @app.listener("before_server_stop")
 async def _before_server_stop(app, loop):
-    aps.stop()
+    await app.ctx.scheduler_leader.stop()
+    await http_client.close()
+    qrcode_renderer.stop()
 
 
 def register_routes(module_name, prefix=""):
@@ -100,6 +238,18 @@ def register_routes(module_name, prefix=""):
                     logger.info(f"routes: {CONST.URL_PREFIX}/{prefix}/{camel2snake(_)}, [{support_method}]")
 
 
+def mysql_credentials() -> dict:
+    pattern = r"(?P<dialect>\w+)://(?P<user>\w+):(?P<password>\w+)@(?P<host>[\d.]+):(?P<port>\d+)/(?P<db>\w+)"
+    m = re.match(pattern, SETTING.MYSQL_URI)
+    return {
+        'host': m.group('host'),
+        'port': m.group('port'),
+        'user': m.group('user'),
+        'password': m.group('password'),
+        'database': m.group('db'),
+    }
+
+
 def run_web_service():
     logger.warning(f"Sanic App {CONST.SYSTEM_APP_NAME} Starting... mode is {'DEV' if SETTING.DEV else 'PRODUCTION'}")
     options = {
@@ -113,19 +263,15 @@ def run_web_service():
     app.config.update(options)
     app.error_handler = _GlobalErrorHandler()
     register_routes('api')
+    register_metrics()
+    install_query_stats()
 
-    pattern = r"(?P<dialect>\w+)://(?P<user>\w+):(?P<password>\w+)@(?P<host>[\d.]+):(?P<port>\d+)/(?P<db>\w+)"
-    m = re.match(pattern, SETTING.MYSQL_URI)
     tortoise_config = {
         'connections': {
             'default': {
                 'engine': 'tortoise.backends.mysql',
                 'credentials': {
-                    'host': m.group('host'),
-                    'port': m.group('port'),
-                    'user': m.group('user'),
-                    'password': m.group('password'),
-                    'database': m.group('db'),
+                    **mysql_credentials(),
                     'pool_recycle': 180  # 回收无用db连接，解决`Packet sequence number wrong - got X expected 1` BUG
                 }
             }
@@ -141,7 +287,10 @@ def run_web_service():
     register_tortoise(app, config=tortoise_config)
 
 
-run_web_service()
+if __name__ != '__mp_main__':
+    # 二维码渲染进程用spawn启动，`python app.py`运行时子进程会把本文件作为__mp_main__重新导入，这时不初始化web服务
+    run_web_service()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000)
+    # 本地调试用单进程运行，Sanic不再spawn worker（worker会以__mp_main__导入本文件）；多worker用`sanic app --workers N`
+    app.run(host='0.0.0.0', port=8000, single_process=True)
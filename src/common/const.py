@@ -8,6 +8,7 @@ class _Const(object):
 
     SYSTEM_SESSIONS_PREFIX = f"{SYSTEM_NAME}_{SUB_SYSTEM_NAME}:sessions"
     SYSTEM_SESSIONS_MAP = f"{SYSTEM_NAME}_{SUB_SYSTEM_NAME}:sessions:map"
+    SCHEDULER_LOCK = f"{SYSTEM_NAME}_{SUB_SYSTEM_NAME}:scheduler"  # 定时任务leader锁（MySQL GET_LOCK）
 
     MAX_BACK_FILE_NUM = 10
     MAX_BACK_FILE_SIZE = 32 * 1024 * 1024
@@ -101,6 +102,7 @@ class _Const(object):
     SESSION_ID = "session_id"
 
     ID = "id"
+    IDS = "ids"
     COURSE_ID = "course_id"
     COURSE_NAME = "course_name"
 
@@ -137,10 +139,14 @@ class _Const(object):
     STAFF_ROLES = 'staff_roles'
     PAGE_SIZE = 'size'
     PAGE_NUM = 'page'
+    AFTER = 'after'  # 游标分页：取id小于该游标的下一页
+    BEFORE = 'before'  # 游标分页：取id大于该游标的上一页
+    WITH_TOTAL = 'with_total'  # 是否统计总数
 
     NAME = 'name'
     NAME_ZH = 'name_zh'
     SUBSCRIBE_COUNTS = 'subscribe_counts'
+    OPENID = 'openid'
     SUBSCRIBE_INCR = 'subscribe_incr'
     BRAND = 'brand'
     PUBLIC = 'public'
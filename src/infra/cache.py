@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import threading
+import time
+import typing
+from collections import OrderedDict
+from contextlib import suppress
+from pathlib import Path
+
+from common.const import CONST
+
+
+class AsyncTTLCache:
+    """
+    进程内异步缓存：容量有界（LRU淘汰）+ TTL过期，同一个key并发加载时只会回源一次。
+    传入index_of时按value维护二级索引（如用户id），可以用invalidate_by按索引失效，不用遍历整个缓存
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60,
+                 index_of: typing.Callable[[typing.Any], typing.Hashable] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.index_of = index_of
+        self._data: OrderedDict[typing.Hashable, typing.Tuple[float, typing.Any]] = OrderedDict()
+        self._index: typing.Dict[typing.Hashable, typing.Set[typing.Hashable]] = {}
+        self._loading: typing.Dict[typing.Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expire_at, value = item
+        if expire_at < time.monotonic():
+            self._remove(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._remove(key)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        index = self._index_value(value)
+        if index is not None:
+            self._index.setdefault(index, set()).add(key)
+        while len(self._data) > self.maxsize:
+            self._remove(next(iter(self._data)))
+
+    def _index_value(self, value) -> typing.Optional[typing.Hashable]:
+        if self.index_of is None or value is None:
+            return None
+        return self.index_of(value)
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is None:
+            return
+        index = self._index_value(item[1])
+        if index is not None:
+            keys = self._index.get(index)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[index]
+
+    def invalidate(self, key):
+        self._remove(key)
+        # 正在回源的结果可能是旧数据，丢弃掉，让其不写入缓存
+        self._loading.pop(key, None)
+
+    def invalidate_by(self, *indexes: typing.Hashable):
+        """
+        按二级索引失效（需要构造时传入index_of）
+        """
+        for index in indexes:
+            for key in self._index.pop(index, ()):
+                self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self._index.clear()
+        self._loading.clear()
+
+    async def get_or_load(self, key, loader: typing.Callable[[], typing.Awaitable]):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        # 回源在独立的task里执行，所有调用方（包括第一个）都shield等待：
+        # 某个调用方被取消（如客户端断开）时不会连带取消回源，也不会影响其他等待同一个key的请求
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = asyncio.ensure_future(self._load(key, loader))
+            task.add_done_callback(_consume_exception)
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader: typing.Callable[[], typing.Awaitable]):
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+        except BaseException:
+            if self._loading.get(key) is task:
+                del self._loading[key]
+            raise
+        if self._loading.get(key) is task:  # 回源期间没有被invalidate，才写入缓存
+            del self._loading[key]
+            self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+_MISSING = object()
+
+
+def _consume_exception(task: asyncio.Task):
+    # 等待方都被取消后回源才失败时，标记异常已被取走，避免打印`exception was never retrieved`
+    if not task.cancelled():
+        task.exception()
+
+
+class BytesLRUCache:
+    """
+    按总字节数限制容量的LRU缓存（value为str/bytes），超出max_bytes时淘汰最久未使用的
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._data: OrderedDict[typing.Hashable, typing.Union[str, bytes]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value: typing.Union[str, bytes]):
+        if len(value) > self.max_bytes:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.current_bytes -= len(old)
+        self._data[key] = value
+        self.current_bytes += len(value)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.current_bytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class DiskBlobStore:
+    """
+    磁盘上按内容寻址的只读blob存储：文件名为key的sha256，写入用临时文件+rename保证原子性，
+    读取用mmap，多个worker进程共享同一目录。命中时刷新文件mtime，写入时按间隔清理：
+    超过max_age未使用的先删，总大小仍超过max_bytes时按mtime从旧到新删。
+    方法都是阻塞IO，在事件循环里要放到线程池执行
+    """
+
+    def __init__(self, path: typing.Union[str, os.PathLike], namespace: str = '', max_bytes: int = 256 * 1024 * 1024,
+                 max_age: float = 7 * 24 * 3600, sweep_interval: float = 600):
+        self.path = Path(path)  # 目录在第一次写入时才创建
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._last_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _file(self, key: str) -> Path:
+        digest = hashlib.sha256(f'{self.namespace}#{key}'.encode(CONST.CODE_UTF8)).hexdigest()
+        return self.path / digest[:2] / digest
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        file = self._file(key)
+        try:
+            with open(file, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = mm[:]
+        except (OSError, ValueError):  # 不存在、无权限；ValueError: 空文件无法mmap
+            self.misses += 1
+            return None
+        self.hits += 1
+        with suppress(OSError):
+            os.utime(file)  # 记录最近使用时间，清理时按mtime淘汰
+        return data
+
+    def put(self, key: str, data: bytes):
+        file = self._file(key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file.with_name(f'{file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, file)
+        self.writes += 1
+        if time.monotonic() - self._last_sweep > self.sweep_interval:
+            self.sweep()
+
+    def sweep(self):
+        """
+        清理过期和超出容量的文件（包括异常退出残留的临时文件）。多个worker同时清理时，文件已被删除的直接跳过
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = time.monotonic()
+            expire_before = time.time() - self.max_age
+            files = []
+            for file in self.path.glob('*/*'):
+                try:
+                    stat = file.stat()
+                    if stat.st_mtime < expire_before:
+                        file.unlink()
+                        self.evictions += 1
+                    else:
+                        files.append((stat.st_mtime, stat.st_size, file))
+                except FileNotFoundError:
+                    continue
+
+            total_bytes = sum(size for _, size, _ in files)
+            if total_bytes > self.max_bytes:
+                for _, size, file in sorted(files, key=lambda item: item[0]):
+                    try:
+                        file.unlink()
+                        self.evictions += 1
+                    except FileNotFoundError:
+                        pass
+                    total_bytes -= size
+                    if total_bytes <= self.max_bytes:
+                        break
+        finally:
+            self._sweep_lock.release()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'evictions': self.evictions}
@@ -1,3 +1,4 @@
+import email.utils
 import datetime
 import time
 
@@ -277,3 +278,13 @@ def get_time_start_str(date_str):
 
 def get_datetime_zero(date_time: datetime.datetime = datetime.datetime.now()) -> datetime.datetime:
     return date_time.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_http_date_str(date_time: datetime.datetime):
+    """
+    HTTP头（Last-Modified等）用的GMT时间格式，naive时间按本地时区处理
+    """
+    if not date_time:
+        return None
+
+    return email.utils.format_datetime(date_time.astimezone(datetime.timezone.utc), usegmt=True)
@@ -0,0 +1,50 @@
+import asyncio
+import typing
+
+import aiohttp
+
+from infra.utils import aio_retry
+from settings.setting import SETTING
+
+
+class AsyncHttpClient:
+    """
+    共享连接池的异步HTTP客户端，复用keep-alive连接，单次调用有超时，失败时异步重试（不阻塞事件循环）
+    """
+
+    def __init__(self, pool_size: int = 100, keepalive_timeout: float = 30, timeout: float = 10):
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # 在事件循环里第一次使用时才创建，保证session绑定的是当前worker的loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    @aio_retry(max_retry=3, name='http_client.request', sleep=0.5, deadline=30,
+               exceptions=(aiohttp.ClientError, asyncio.TimeoutError))
+    async def request(self, method: str, url: str, timeout: float = None, **kwargs) -> aiohttp.ClientResponse:
+        """
+        发送请求并读完响应体（之后可以直接`await response.json()`）。4xx直接返回，5xx及网络异常则重试
+        """
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+
+        async with self._get_session().request(method, url, **kwargs) as response:
+            await response.read()
+            if not 400 <= response.status < 500:
+                response.raise_for_status()
+            return response
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_client = AsyncHttpClient(pool_size=SETTING.HTTP_POOL_SIZE, timeout=SETTING.HTTP_TIMEOUT)
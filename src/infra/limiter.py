@@ -0,0 +1,124 @@
+import logging
+import os
+import sqlite3
+import time
+import typing
+from pathlib import Path
+
+from loggers.logger import client_error_log
+
+
+class MemoryLimiterBackend:
+    """
+    进程内GCRA状态：每个key只存一个TAT（理论到达时间），判断和更新都是O(1)，
+    TAT早于当前时间的key已经“满额”，不需要保存，定期清理
+    """
+
+    def __init__(self, sweep_interval: float = 60):
+        self.sweep_interval = sweep_interval
+        self._tat: typing.Dict[str, float] = {}
+        self._last_sweep = time.time()
+
+    def acquire(self, key: str, now: float, interval: float, tolerance: float) -> bool:
+        self._sweep(now)
+        tat = self._tat.get(key, now)
+        if tat - now > tolerance:
+            return False
+        self._tat[key] = max(tat, now) + interval
+        return True
+
+    def _sweep(self, now: float):
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        for key in [k for k, tat in self._tat.items() if tat <= now]:
+            del self._tat[key]
+
+    def __len__(self):
+        return len(self._tat)
+
+
+class SqliteLimiterBackend:
+    """
+    基于本地SQLite文件的GCRA状态，同一台机器上的多个worker共享限流。
+    判断在事件循环里同步执行，所以锁等待很短（busy_timeout）；拿不到锁或数据库出错时按fail_open放行或拒绝，
+    不把`database is locked`抛给客户端
+    """
+
+    def __init__(self, path: str, sweep_interval: float = 60, busy_timeout: float = 0.05, fail_open: bool = True):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.busy_timeout = busy_timeout
+        self.fail_open = fail_open
+        self.errors = 0
+        self._last_sweep = time.time()
+        self._conn: typing.Optional[sqlite3.Connection] = None
+        self._pid: typing.Optional[int] = None
+
+    def _get_conn(self) -> sqlite3.Connection:
+        # 第一次用时才建连接；按pid区分，fork出来的进程不复用父进程的连接
+        if self._conn is None or self._pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS limiter (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def acquire(self, key: str, now: float, interval: float, tolerance: float) -> bool:
+        try:
+            conn = self._get_conn()
+            self._sweep(conn, now)
+            return self._acquire(conn, key, now, interval, tolerance)
+        except (sqlite3.Error, OSError) as e:
+            self.errors += 1
+            client_error_log('limiter.sqlite', f'Limiter sqlite backend unavailable, '
+                                               f'{"allow" if self.fail_open else "deny"} {key}, '
+                                               f'{e.__class__.__name__}<{str(e)}>', level=logging.ERROR)
+            return self.fail_open
+
+    @staticmethod
+    def _acquire(conn: sqlite3.Connection, key: str, now: float, interval: float, tolerance: float) -> bool:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM limiter WHERE key = ?", (key,)).fetchone()
+            tat = row[0] if row else now
+            allowed = tat - now <= tolerance
+            if allowed:
+                conn.execute("INSERT INTO limiter (key, tat) VALUES (?, ?) "
+                             "ON CONFLICT(key) DO UPDATE SET tat = excluded.tat", (key, max(tat, now) + interval))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+    def _sweep(self, conn: sqlite3.Connection, now: float):
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        conn.execute("DELETE FROM limiter WHERE tat <= ?", (now,))
+
+    def __len__(self):
+        return self._get_conn().execute("SELECT COUNT(*) FROM limiter").fetchone()[0]
+
+
+class RateLimiter:
+    """
+    GCRA限流：seconds秒内最多capacity次（允许capacity次的突发），每次判断只读写一个时间戳
+    """
+
+    def __init__(self, backend: typing.Union[MemoryLimiterBackend, SqliteLimiterBackend]):
+        self.backend = backend
+
+    def acquire(self, key: str, seconds: float, capacity: int) -> bool:
+        interval = seconds / capacity
+        return self.backend.acquire(key, time.time(), interval, seconds - interval)
+
+
+def create_rate_limiter(backend: str, sqlite_path: str = None, fail_open: bool = True) -> RateLimiter:
+    if backend == 'sqlite':
+        return RateLimiter(SqliteLimiterBackend(sqlite_path, fail_open=fail_open))
+    return RateLimiter(MemoryLimiterBackend())
@@ -0,0 +1,126 @@
+import os
+import re
+import typing
+from bisect import bisect_left
+from collections import defaultdict
+
+from common.const import CONST
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # 秒
+
+Sample = typing.Tuple[str, typing.Dict[str, typing.Any], float]  # (指标名, 标签, 值)
+
+
+class Histogram:
+    """
+    固定分桶的直方图，observe只做一次二分查找和几次加法；输出时再累加成Prometheus要求的累计桶
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个是+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    进程内指标：按路由的耗时直方图、按路由+状态码的响应计数、按路由的在途请求数，
+    以及注册进来的各组件统计（collector）。多worker时每个进程各自统计，输出带worker标签
+    """
+
+    def __init__(self, namespace: str, buckets: typing.Sequence[float] = LATENCY_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self.latency: typing.Dict[typing.Tuple[str, str], Histogram] = {}
+        self.responses: typing.Dict[typing.Tuple[str, str, int], int] = defaultdict(int)
+        self.in_flight: typing.Dict[str, int] = defaultdict(int)
+        self.db_queries: typing.Dict[str, int] = defaultdict(int)
+        self.db_seconds: typing.Dict[str, float] = defaultdict(float)
+        self._collectors: typing.Dict[str, typing.Callable[[], typing.Iterable[Sample]]] = {}
+
+    def request_started(self, route: str):
+        self.in_flight[route] += 1
+
+    def request_finished(self, route: str, method: str, status: int, seconds: float):
+        self.in_flight[route] -= 1
+        histogram = self.latency.get((route, method))
+        if histogram is None:
+            histogram = self.latency[(route, method)] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        self.responses[(route, method, status)] += 1
+
+    def request_queries(self, route: str, count: int, seconds: float):
+        self.db_queries[route] += count
+        self.db_seconds[route] += seconds
+
+    def add_collector(self, name: str, collect: typing.Callable[[], typing.Iterable[Sample]]):
+        self._collectors[name] = collect
+
+    def render(self) -> str:
+        """
+        Prometheus文本格式
+        """
+        ns = self.namespace
+        lines = [f'# TYPE {ns}_request_duration_seconds histogram']
+        for (route, method), histogram in self.latency.items():
+            labels = self._labels(route=route, method=method)
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                cumulative += count
+                lines.append(f'{ns}_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{ns}_request_duration_seconds_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{ns}_request_duration_seconds_count{{{labels}}} {histogram.count}')
+
+        lines.append(f'# TYPE {ns}_responses_total counter')
+        for (route, method, status), count in self.responses.items():
+            lines.append(f'{ns}_responses_total{{{self._labels(route=route, method=method, status=status)}}} {count}')
+
+        lines.append(f'# TYPE {ns}_requests_in_flight gauge')
+        for route, count in self.in_flight.items():
+            lines.append(f'{ns}_requests_in_flight{{{self._labels(route=route)}}} {count}')
+
+        lines.append(f'# TYPE {ns}_db_queries_total counter')
+        for route, count in self.db_queries.items():
+            lines.append(f'{ns}_db_queries_total{{{self._labels(route=route)}}} {count}')
+        lines.append(f'# TYPE {ns}_db_seconds_total counter')
+        for route, seconds in self.db_seconds.items():
+            lines.append(f'{ns}_db_seconds_total{{{self._labels(route=route)}}} {seconds}')
+
+        for name, collect in self._collectors.items():
+            lines.append(f'# {name}')
+            for metric, labels, value in collect():
+                lines.append(f'{ns}_{metric}{{{self._labels(**labels)}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _labels(self, **labels) -> str:
+        labels['worker'] = os.getpid()  # 多worker时区分进程，fork出来的进程也能拿到自己的pid
+        return ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+
+def flatten_stats(prefix: str, stats: dict) -> typing.Iterator[Sample]:
+    """
+    把组件stats()返回的嵌套dict展开成指标，如{'memory': {'hits': 1}} -> <prefix>_memory_hits
+    """
+    for key, value in stats.items():
+        name = f'{prefix}_{_sanitize(key)}'
+        if isinstance(value, dict):
+            yield from flatten_stats(name, value)
+        elif isinstance(value, (int, float)):
+            yield name, {}, value
+
+
+def _sanitize(name) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', str(name))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = MetricsRegistry(CONST.SYSTEM_NAME + '_' + CONST.SUB_SYSTEM_NAME)
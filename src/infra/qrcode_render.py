@@ -0,0 +1,70 @@
+# 二维码渲染，运行在进程池的worker里（只依赖Pillow/qrcode，避免子进程加载整个应用）
+import base64
+import os.path
+from io import BytesIO
+
+import qrcode
+from PIL import Image
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logo.png')
+
+_logo: Image.Image = None
+_logo_resized: dict[int, Image.Image] = {}  # logo边长 -> 缩放后的logo
+
+
+def init_worker():
+    """
+    进程池initializer：logo只解码一次
+    """
+    global _logo
+    _logo = Image.open(LOGO_PATH)
+    _logo.load()
+
+
+def _get_logo(logo_size: int) -> Image.Image:
+    # 二维码尺寸只随version变化，缩放结果按边长缓存即可
+    logo = _logo_resized.get(logo_size)
+    if logo is None:
+        if _logo is None:
+            init_worker()
+        logo = _logo_resized[logo_size] = _logo.resize((logo_size, logo_size), Image.Resampling.BILINEAR)
+    return logo
+
+
+def render_qrcode(s: str) -> bytes:
+    """
+    生成字符串对应的二维码图片（PNG字节）
+    """
+    qr = qrcode.QRCode(
+        version=2,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=10,
+        border=4,
+    )
+
+    # 添加数据到 QR 码
+    qr.add_data(s)
+    qr.make(fit=True)
+
+    # 创建 QR 码图像
+    img_qr = qr.make_image(fill_color="black", back_color="white").convert("RGB")
+
+    # 计算 logo 的大小（这里我们设定 logo 大小为 QR 码的 1/5）
+    logo_size = int(min(img_qr.size) / 5)
+    logo = _get_logo(logo_size)
+
+    # 计算 logo 在 QR 码上的位置，并粘贴到 QR 码上
+    pos = ((img_qr.size[0] - logo_size) // 2, (img_qr.size[1] - logo_size) // 2)
+    img_qr.paste(logo, pos)
+
+    # 保存二维码图像到字节流，格式为PNG
+    byte_io = BytesIO()
+    img_qr.save(byte_io, 'PNG')
+    return byte_io.getvalue()
+
+
+def png2base64(png: bytes) -> str:
+    """
+    创建一个完整的Base64编码的图像数据字符串
+    """
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('utf-8')
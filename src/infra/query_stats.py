@@ -0,0 +1,93 @@
+import re
+import time
+import typing
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+
+from tortoise.backends.mysql.client import MySQLClient, TransactionWrapper
+
+
+class QueryStats:
+    """
+    单个请求内的SQL统计：条数、总耗时，以及执行过的SQL（只存引用，超预算打日志时才做指纹归并）
+    """
+    __slots__ = ('count', 'seconds', 'queries')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.queries: typing.List[str] = []
+
+    def record(self, query: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.queries.append(query)
+
+    def fingerprints(self) -> typing.List[typing.Tuple[str, int]]:
+        """
+        按指纹归并后的SQL及次数，次数多的在前（同一条SQL多次出现通常就是N+1）
+        """
+        return Counter(map(fingerprint, self.queries)).most_common()
+
+
+_current_stats: ContextVar[typing.Optional[QueryStats]] = ContextVar('query_stats', default=None)
+
+
+def start_query_stats() -> QueryStats:
+    """
+    请求开始时调用，之后同一个请求（同一个上下文）里执行的SQL都计入返回的QueryStats
+    """
+    stats = QueryStats()
+    _current_stats.set(stats)
+    return stats
+
+
+def stop_query_stats():
+    _current_stats.set(None)
+
+
+_FINGERPRINT_PATTERNS = (
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),  # 字符串
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # 数字
+    (re.compile(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)'), '(...)'),  # IN列表
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def fingerprint(query: str) -> str:
+    for pattern, repl in _FINGERPRINT_PATTERNS:
+        query = pattern.sub(repl, query)
+    return query.strip()
+
+
+def _instrument(cls, name: str):
+    original = cls.__dict__[name]
+    if getattr(original, '__query_stats__', False):
+        return
+
+    @wraps(original)
+    async def wrapper(self, query, *args, **kwargs):
+        stats = _current_stats.get()
+        if stats is None:
+            return await original(self, query, *args, **kwargs)
+        start_time = time.perf_counter()
+        try:
+            return await original(self, query, *args, **kwargs)
+        finally:
+            stats.record(query, time.perf_counter() - start_time)
+
+    wrapper.__query_stats__ = True
+    setattr(cls, name, wrapper)
+
+
+def install_query_stats(*client_classes):
+    """
+    包装Tortoise客户端的execute_*方法做统计（execute_query_dict内部调用execute_query，不重复包装）。
+    TransactionWrapper重写了execute_many，需要单独包装，其余方法继承自MySQLClient
+    """
+    targets = client_classes or (MySQLClient, TransactionWrapper)
+    for cls in targets:
+        for name in ('execute_insert', 'execute_many', 'execute_query', 'execute_script'):
+            if name in cls.__dict__:
+                _instrument(cls, name)
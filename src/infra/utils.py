@@ -1,43 +1,95 @@
-import base64
+import asyncio
+import datetime
 import inspect
-import os.path
+import json
+import multiprocessing
+import random
 import re
 import time
 import typing
-from functools import lru_cache, wraps
-from io import BytesIO
-from PIL import Image
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from enum import Enum
+from functools import partial, wraps
 
-import qrcode
-import requests
 from sanic.response import json as sanic_json
 from sanic.request import Request
 
 from common.const import CONST
-from loggers.logger import logger
+from infra.cache import BytesLRUCache, DiskBlobStore
+from infra.limiter import create_rate_limiter
+from infra.qrcode_render import init_worker, render_qrcode, png2base64
+from loggers.logger import logger, client_error_log
 from settings.setting import SETTING
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_default(obj):
+    """
+    编码器不认识的类型：Decimal转float，时间按CONST里的格式，枚举取值。
+    model的字段已经在to_dict里按字段格式化（如expire_time只取日期），这里只兜底resp_*里直接传入的值
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(CONST.DATETIME_FORMAT)
+    if isinstance(obj, datetime.date):
+        return obj.strftime(CONST.DATE_FORMAT)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def json_dumps(obj, **_) -> bytes:
+        # 时间类型交给_json_default，保持与to_dict一致的格式（orjson默认是ISO 8601）
+        return orjson.dumps(obj, default=_json_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+else:
+    # 与原先sanic默认的json.dumps一致（非ASCII字符转义）
+    json_dumps = partial(json.dumps, default=_json_default, separators=(',', ':'))
+
+_SUCCESS_MESSAGE = CONST.SUCCESS.lower()
+
 
 def resp_success(resp_data: dict = None, **kwargs):
-    resp_data = resp_data or {}
-    result = {
-        CONST.MESSAGE: CONST.SUCCESS.lower()
-    }
-    result.update(resp_data)
-    result.update(kwargs)
-    return sanic_json(result)
+    if resp_data:
+        result = {CONST.MESSAGE: _SUCCESS_MESSAGE, **resp_data, **kwargs}
+    else:
+        result = {CONST.MESSAGE: _SUCCESS_MESSAGE, **kwargs}
+    return sanic_json(result, dumps=json_dumps)
 
 
 def resp_failure(status_code, reason, resp_data: dict = None, print_log: bool = True, **kwargs):
-    resp_data = resp_data or {}
-    result = {
-        CONST.MESSAGE: reason
-    }
-    result.update(resp_data)
-    result.update(kwargs)
+    if resp_data:
+        result = {CONST.MESSAGE: reason, **resp_data, **kwargs}
+    else:
+        result = {CONST.MESSAGE: reason, **kwargs}
     if print_log:
-        logger.error(f'{result}, {status_code}')
-    return sanic_json(result, status=status_code)
+        if status_code < 500:
+            client_error_log(str(status_code), f'{result}, {status_code}')
+        else:
+            logger.error(f'{result}, {status_code}')
+    return sanic_json(result, status=status_code, dumps=json_dumps)
+
+
+def etag_matched(request: Request, etag: str) -> bool:
+    """
+    请求头If-None-Match是否命中etag（弱比较），命中则可以直接返回304
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tag = etag.removeprefix('W/')
+    return any(t.strip().removeprefix('W/') == tag for t in if_none_match.split(','))
 
 
 def page_num_size(request: Request):
@@ -57,6 +109,42 @@ def page_num_size(request: Request):
     return page_num, page_size
 
 
+def page_cursor(request: Request) -> typing.Tuple[bool, typing.Optional[int], typing.Optional[int]]:
+    """
+    解析游标分页参数，返回(是否游标模式, after, before)。带了after/before参数就是游标模式，
+    `after=0`表示从最新一条开始（Sanic默认丢弃空值参数，`after=`等同于没传）；游标不是数字时返回400
+    """
+    after = _parse_cursor(request, CONST.AFTER)
+    before = _parse_cursor(request, CONST.BEFORE)
+    if after is None and before is None:
+        return False, None, None
+    return True, after or None, before or None
+
+
+def _parse_cursor(request: Request, name: str) -> typing.Optional[int]:
+    value = request.args.get(name)
+    if not value:
+        return None
+    if not value.isdigit():
+        raise ClientError(f"invalid cursor {name}={value}")
+    return int(value)
+
+
+def page_with_total(request: Request, default: bool = True) -> bool:
+    with_total = request.args.get(CONST.WITH_TOTAL)
+    if not with_total:
+        return default
+    return with_total.lower() not in ('0', 'false', 'no')
+
+
+def is_first_page(request: Request) -> bool:
+    cursor_mode, after, before = page_cursor(request)
+    if cursor_mode:
+        return after is None and before is None
+    page_num, _ = page_num_size(request)
+    return page_num == 1
+
+
 def snake2camel(snake: str, start_lower: bool = False) -> str:
     """
     Converts a snake_case string to camelCase.
@@ -80,55 +168,111 @@ def camel2snake(camel: str) -> str:
     return snake.lower()
 
 
-@lru_cache()
-def str2base64(s: str) -> str:
+class QrcodeRenderer:
     """
-    生成字符串对应的图片（base64字符串）
+    二维码渲染进程池：Pillow编码不占用事件循环。排队中的任务数有上限，超出则按限流处理。
+    渲染结果先查内存（按字节数限制的LRU），再查磁盘（多worker共享），都没有才渲染
     """
-    qr = qrcode.QRCode(
-        version=2,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
-        border=4,
-    )
-
-    # 添加数据到 QR 码
-    qr.add_data(s)
-    qr.make(fit=True)
-
-    # 创建 QR 码图像
-    img_qr = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-
-    # 打开 logo 文件
-    # logo = Image.open('my_avatar.png')
-    logo = Image.open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logo.png'))
-
-    # 计算 logo 的大小（这里我们设定 logo 大小为 QR 码的 1/4）
-    logo_size = int(min(img_qr.size) / 5)
-
-    # 重新设置 logo 的大小
-    logo = logo.resize((logo_size, logo_size), Image.Resampling.BILINEAR)
-
-    # 计算 logo 在 QR 码上的位置
-    pos = ((img_qr.size[0] - logo_size) // 2, (img_qr.size[1] - logo_size) // 2)
-
-    # 将 logo 粘贴到 QR 码上
-    img_qr.paste(logo, pos)
-
-    # 创建一个字节流来保存二维码图像
-    byte_io = BytesIO()
-
-    # 保存二维码图像到字节流，格式为PNG
-    img_qr.save(byte_io, 'PNG')
-
-    # 将字节流的内容转换为Base64编码的字符串
-    base64_str = base64.b64encode(byte_io.getvalue()).decode('utf-8')
-
-    # 创建一个完整的Base64编码的图像数据字符串
-    base64_image = 'data:image/png;base64,' + base64_str
-
-    # 打印或返回Base64编码的图像数据字符串
-    return base64_image
+    RENDER_VERSION = 'v1'  # 渲染参数（尺寸、纠错级别、logo）变化时修改，使磁盘上的旧图失效
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 64, cache_bytes: int = 16 * 1024 * 1024,
+                 cache_dir: str = None, cache_dir_bytes: int = 256 * 1024 * 1024, cache_dir_ttl: float = 7 * 24 * 3600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.renders = 0
+        self.cache = BytesLRUCache(max_bytes=cache_bytes)
+        self.store = DiskBlobStore(cache_dir, namespace=self.RENDER_VERSION, max_bytes=cache_dir_bytes,
+                                   max_age=cache_dir_ttl) if cache_dir else None
+        self._executor: typing.Optional[ProcessPoolExecutor] = None
+        self._loading: typing.Dict[str, asyncio.Task] = {}
+
+    def start(self):
+        if self._executor is None:
+            # spawn出来的子进程导入infra.qrcode_render，并在initializer里预先解码logo；启动脚本会作为__mp_main__重新导入，
+            # `sanic app`时是sanic命令行入口，`python app.py`时是app.py（其中跳过了web服务初始化）
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=init_worker)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, s: str) -> str:
+        base64_image = self.cache.get(s)
+        if base64_image is not None:
+            return base64_image
+
+        # 同一个字符串并发请求时只渲染一次；渲染在独立的task里，某个请求断开不会取消其他请求
+        task = self._loading.get(s)
+        if task is None:
+            task = self._loading[s] = asyncio.ensure_future(self._render(s))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _render(self, s: str) -> str:
+        try:
+            base64_image = png2base64(await self._load_png(s))
+        finally:
+            del self._loading[s]
+        self.cache.set(s, base64_image)
+        return base64_image
+
+    async def _load_png(self, s: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        # 磁盘读写放到线程池，不阻塞事件循环
+        png = await loop.run_in_executor(None, self.store.get, s) if self.store else None
+        if png is not None:
+            return png
+
+        if self.pending >= self.max_pending:
+            raise LimiterExceedError(f"Qrcode render queue is full ({self.pending}).")
+
+        self.start()
+        executor = self._executor
+        self.pending += 1
+        try:
+            png = await loop.run_in_executor(executor, render_qrcode, s)
+        except BrokenProcessPool:
+            # 渲染进程异常退出（如OOM、Pillow崩溃）后进程池不可再用，丢弃掉，下次调用重建
+            logger.error('Qrcode render pool broken, restart it on next render')
+            if self._executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            raise
+        finally:
+            self.pending -= 1
+        self.renders += 1
+        if self.store:
+            try:
+                await loop.run_in_executor(None, self.store.put, s, png)
+            except OSError as e:
+                # 磁盘缓存写失败（如磁盘满、无权限）不影响本次返回
+                logger.error(f'Qrcode disk cache put failed, {e.__class__.__name__}<{str(e)}>')
+        return png
+
+    def stats(self) -> dict:
+        return {
+            'memory': self.cache.stats(),
+            'disk': self.store.stats() if self.store else {},
+            'renders': self.renders,
+            'pending': self.pending
+        }
+
+
+qrcode_renderer = QrcodeRenderer(max_workers=SETTING.QRCODE_WORKERS, max_pending=SETTING.QRCODE_MAX_PENDING,
+                                 cache_bytes=SETTING.QRCODE_CACHE_BYTES, cache_dir=SETTING.QRCODE_CACHE_DIR,
+                                 cache_dir_bytes=SETTING.QRCODE_CACHE_DIR_BYTES,
+                                 cache_dir_ttl=SETTING.QRCODE_CACHE_DIR_TTL)
+
+
+async def str2base64(s: str) -> str:
+    """
+    生成字符串对应的图片（base64字符串），在进程池里渲染
+    """
+    return await qrcode_renderer.render(s)
 
 
 def days_bill_description(limit_days):
@@ -145,6 +289,10 @@ def days_bill_description(limit_days):
             assert False, "Invalid limit_days"
 
 
+retry_stats: typing.Dict[str, typing.Dict[str, int]] = defaultdict(
+    lambda: {'calls': 0, 'attempts': 0, 'retries': 0, 'failures': 0})  # 按函数名统计的重试计数
+
+
 def retry(
         max_retry: int = 3,
         name: str = None,
@@ -158,9 +306,12 @@ def retry(
             nonlocal name
             if not name:
                 name = get_module_func(func)
+            stats = retry_stats[name]
+            stats['calls'] += 1
             retry_turn = 0
             while True:
                 try:
+                    stats['attempts'] += 1
                     return_value = func(*args, **kwargs)
                     if not can_be_none and return_value is None:
                         raise Exception('NoneResultError, func:{} returns None'.format(name))
@@ -175,10 +326,12 @@ def retry(
                     if max_retry and retry_turn > max_retry:
                         break
 
+                    stats['retries'] += 1
                     sleep_seconds = sleep_strategy(retry_turn) if sleep_strategy else sleep
                     logger.warning('func:{} next retry after {} seconds'.format(name, sleep_seconds))
                     time.sleep(sleep_seconds)
 
+            stats['failures'] += 1
             raise Exception('MaxRetryError, func:{}, failed:{}, retry turn: {}'.format(name, exec_info, retry_turn))
 
         return wrapper
@@ -186,15 +339,65 @@ def retry(
     return decorate
 
 
-@retry(max_retry=6)
-def requests_retry(method, url, **kwargs) -> requests.Response:
-    """发送GET请求并返回响应"""
-    kwargs['timeout'] = 300
-    response = requests.request(method, url, **kwargs)
-    if 400 <= response.status_code < 500:
-        return response
-    response.raise_for_status()  # 如果响应错误（例如404 Not Found）将引发异常
-    return response
+def aio_retry(
+        max_retry: int = 3,
+        name: str = None,
+        sleep: float = 0.5,
+        max_sleep: float = 10,
+        deadline: float = None,
+        exceptions: typing.Tuple[typing.Type[BaseException], ...] = (Exception,),
+        can_be_none: bool = True
+):
+    """
+    协程版retry：用asyncio.sleep等待，不阻塞事件循环。等待时间按指数退避（sleep * 2^n，不超过max_sleep）并加随机抖动，
+    deadline为从首次调用起的总耗时上限（秒）：每次调用的超时不超过剩余时间，下一次等待会超过deadline时不再重试
+    """
+
+    def decorate(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            nonlocal name
+            if not name:
+                name = get_module_func(func)
+            stats = retry_stats[name]
+            stats['calls'] += 1
+            start_time = time.monotonic()
+            retry_turn = 0
+            while True:
+                try:
+                    stats['attempts'] += 1
+                    if deadline is None:
+                        return_value = await func(*args, **kwargs)
+                    else:
+                        remaining = deadline - (time.monotonic() - start_time)
+                        return_value = await asyncio.wait_for(func(*args, **kwargs), max(remaining, 0))
+                    if not can_be_none and return_value is None:
+                        raise Exception('NoneResultError, func:{} returns None'.format(name))
+                    return return_value
+                except exceptions as e:
+                    exec_info = f'{e.__class__.__name__}<{str(e)}>'
+                    logger.warning(
+                        'func:{}, failed:{}, args:{}, kwargs:{}, retry:{}/{}...'.format(name, exec_info, args, kwargs,
+                                                                                        retry_turn, max_retry))
+                    retry_turn += 1
+
+                    if max_retry and retry_turn > max_retry:
+                        break
+
+                    sleep_seconds = random.uniform(0, min(max_sleep, sleep * 2 ** (retry_turn - 1)))  # full jitter
+                    if deadline is not None and time.monotonic() - start_time + sleep_seconds > deadline:
+                        break
+
+                    stats['retries'] += 1
+                    logger.warning('func:{} next retry after {:.2f} seconds'.format(name, sleep_seconds))
+                    await asyncio.sleep(sleep_seconds)
+
+            stats['failures'] += 1
+            raise Exception('MaxRetryError, func:{}, failed:{}, retry turn: {}'.format(name, exec_info, retry_turn))
+
+        return wrapper
+
+    return decorate
 
 
 def get_openid(request):
@@ -223,28 +426,44 @@ def get_module_func(func: typing.Callable = None):
     return f'{current_module_name}:{line_no}:{current_function_name}'
 
 
-class LimiterExceedError(Exception):
-    pass
+class ClientError(Exception):
+    """
+    可预期的客户端错误，全局异常处理按status_code/reason返回，只记一行限频日志，不打印堆栈
+    """
+    status_code = 400
+    reason = "请求参数错误"
+
+
+class NotFoundError(ClientError):
+    status_code = 404
+    reason = "记录不存在"
+
 
+class ForbiddenError(ClientError):
+    status_code = 403
+    reason = "您的权限不足以操作"
 
-token_buckets = {}  # 使用字典作为内存存储
+
+class LimiterExceedError(ClientError):
+    status_code = 429
+    reason = "操作太快啦，慢一点~"
+
+
+rate_limiter = create_rate_limiter(SETTING.LIMITER_BACKEND, SETTING.LIMITER_SQLITE_PATH,
+                                   fail_open=SETTING.LIMITER_FAIL_OPEN)
 
 
 def limiter_deco(identifier_func: typing.Callable, seconds: float = 2, capacity: int = 1,
                  exceed_handle: typing.Any = LimiterExceedError("Too many requests, please try again.")):
     def decorator(func):
+        func_key = '@' + get_module_func(func)  # 装饰时算一次，避免每次请求都读源码
+
         @wraps(func)
         def wrapper(request: Request, *args, **kwargs):
-            current_time = time.time()
-            key = identifier_func(request) + '@' + get_module_func(func)
-
-            # 移除seconds秒前的请求记录
-            if key in token_buckets:
-                token_buckets[key] = [t for t in token_buckets[key] if t >= current_time - seconds]
+            key = identifier_func(request) + func_key
 
             # 检查当前是否超过请求数量限制
-            if len(token_buckets.get(key, [])) < capacity:
-                token_buckets.setdefault(key, []).append(current_time)
+            if rate_limiter.acquire(key, seconds, capacity):
                 return func(request, *args, **kwargs)
             else:
                 if callable(exceed_handle):
@@ -1,5 +1,10 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import re
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
 
 import colorlog
@@ -13,7 +18,17 @@ LOG_PATH.mkdir(parents=True, exist_ok=True)
 
 
 def get_logger_file_name(prefix=""):
-    return CONST.SYSTEM_NAME + '_' + CONST.SUB_SYSTEM_NAME + prefix + '.log'
+    return CONST.SYSTEM_NAME + '_' + CONST.SUB_SYSTEM_NAME + get_worker_suffix() + prefix + '.log'
+
+
+def get_worker_suffix() -> str:
+    """
+    多worker时每个进程写自己的日志文件（如fitness_wb.Sanic-Server-0-0.log）：RotatingFileHandler的滚动不是进程安全的，
+    多个进程滚动同一个文件会丢日志、串行。用Sanic的worker名而不是pid，worker重启后沿用原来的文件，文件数不会增长；
+    主进程和单进程运行时没有worker名，仍写原来的文件
+    """
+    worker_name = os.getenv('SANIC_WORKER_NAME')
+    return '.' + re.sub(r'[^0-9A-Za-z_-]', '_', worker_name) if worker_name else ''
 
 
 def get_logger_format() -> str:
@@ -28,7 +43,8 @@ def get_logger_format() -> str:
 
 def add_rotating_file_handler(_log, file_name, level=None):
     handler = RotatingFileHandler(
-        file_name, maxBytes=CONST.MAX_BACK_FILE_SIZE, backupCount=CONST.MAX_BACK_FILE_NUM, encoding=CONST.UTF_8)
+        file_name, maxBytes=CONST.MAX_BACK_FILE_SIZE, backupCount=CONST.MAX_BACK_FILE_NUM, encoding=CONST.UTF_8,
+        delay=True)  # 第一次写日志时才打开文件，不写日志的进程（如spawn出来的子进程）不占用文件
 
     if level:
         handler.setLevel(level)
@@ -43,11 +59,81 @@ def add_stream_handler(_log):
     _log.addHandler(stream_handler)
 
 
+class DroppingQueueHandler(QueueHandler):
+    """
+    有界队列的QueueHandler，队列满时按策略处理：
+    drop_oldest丢掉最旧的一条再入队，drop_newest丢掉当前这条，block阻塞等待；丢掉的条数记在dropped
+    """
+
+    def __init__(self, log_queue: queue.Queue, policy: str = 'drop_oldest'):
+        super().__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.policy == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            self.dropped += 1
+            if self.policy != 'drop_oldest':
+                return
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:  # 被其他线程抢先填满，这条也丢掉
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {'size': self.queue.qsize(), 'maxsize': self.queue.maxsize, 'dropped': self.dropped}
+
+
+class _QueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # 队列满时put_nowait会失败，退出时阻塞等后台线程腾出位置，保证队列里的日志都写完
+        self.queue.put(self._sentinel)
+
+
+_queue_handlers: list[DroppingQueueHandler] = []
+
+
+def attach_queue_handler(_log):
+    """
+    把_log上已有的handler挪到后台线程：调用方（事件循环）只入队，
+    文件写入、滚动和控制台输出都在QueueListener线程里完成，文件名和滚动规则不变
+    """
+    handlers = list(_log.handlers)
+    for handler in handlers:
+        _log.removeHandler(handler)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=SETTING.LOG_QUEUE_SIZE), SETTING.LOG_QUEUE_POLICY)
+    listener = _QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    queue_handler.listener = listener
+    _log.addHandler(queue_handler)
+    _queue_handlers.append(queue_handler)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
+
+
+def log_queue_stats() -> dict:
+    stats = [handler.stats() for handler in _queue_handlers]
+    return {'size': sum(s['size'] for s in stats), 'dropped': sum(s['dropped'] for s in stats)}
+
+
 def init_logger(log_level):
     _log = logging.getLogger(CONST.SYSTEM_NAME + '_' + CONST.SUB_SYSTEM_NAME)
     add_rotating_file_handler(_log, LOG_PATH / get_logger_file_name('.error'), level=logging.ERROR)
     add_rotating_file_handler(_log, LOG_PATH / get_logger_file_name())
     add_stream_handler(_log)
+    attach_queue_handler(_log)
     _log.setLevel(log_level)
     _log.propagate = False
     return _log
@@ -56,6 +142,36 @@ def init_logger(log_level):
 logger = init_logger(logging.getLevelName(SETTING.LOG_LEVEL))
 
 
+class RateLimitedLog:
+    """
+    限频日志：同一个key在interval秒内只输出一行，期间被压掉的条数附在下一行里。
+    用于客户端错误这类可预期、可能被刷的日志，不格式化堆栈
+    """
+
+    def __init__(self, _log: logging.Logger, interval: float = 1):
+        self._log = _log
+        self.interval = interval
+        self._last: dict[str, float] = {}
+        self._suppressed: dict[str, int] = {}
+
+    def __call__(self, key: str, msg: str, level: int = logging.WARNING):
+        if not self._log.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return
+        self._last[key] = now
+        suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            msg += f" (suppressed {suppressed} similar)"
+        self._log.log(level, msg, stacklevel=2)
+
+
+client_error_log = RateLimitedLog(logger)
+
+
 def get_other_logger_format(module_name: str):
     fmt = '[%(levelname)s]'
     fmt += f'-[{module_name.title()}]'
@@ -66,7 +182,8 @@ def get_other_logger_format(module_name: str):
 
 def add_other_rotating_file_handler(_log, module_name: str, file_name, level=None):
     handler = RotatingFileHandler(
-        file_name, maxBytes=CONST.MAX_BACK_FILE_SIZE, backupCount=CONST.MAX_BACK_FILE_NUM, encoding=CONST.UTF_8)
+        file_name, maxBytes=CONST.MAX_BACK_FILE_SIZE, backupCount=CONST.MAX_BACK_FILE_NUM, encoding=CONST.UTF_8,
+        delay=True)
 
     if level:
         handler.setLevel(level)
@@ -86,6 +203,7 @@ def init_other_logger(log_level, module_name: str):
     add_other_rotating_file_handler(_log, module_name, LOG_PATH / get_logger_file_name('.error'), level=logging.ERROR)
     add_other_rotating_file_handler(_log, module_name, LOG_PATH / get_logger_file_name())
     add_other_stream_handler(_log, module_name)
+    attach_queue_handler(_log)
     _log.setLevel(log_level)
     _log.propagate = False
     return _log
@@ -1,21 +1,65 @@
-from api import paging
+import hashlib
+import typing
+from datetime import datetime
+
+from api import list_paging
 from common.const import CONST
+from infra.cache import AsyncTTLCache
 from orm.model import CourseModel
+from settings.setting import SETTING
+
+
+class CourseCatalogue:
+    """
+    课程目录快照：全部课程（按id倒序，已序列化）、id->封面图映射，以及用于协商缓存的版本号和最后修改时间
+    """
+
+    def __init__(self, courses: typing.List[CourseModel]):
+        self.items = CourseModel.to_dicts(courses)
+        self.thumbnails = {course.id: course.thumbnail for course in courses}
+        self.last_modified: typing.Optional[datetime] = max((c.update_time for c in courses), default=None)
+        # 任意课程增删改都会改变(id, update_time)集合，版本号随之变化
+        self.version = hashlib.sha1(
+            ','.join(f'{c.id}@{c.update_time.timestamp()}' for c in courses).encode(CONST.CODE_UTF8)).hexdigest()
+
+    def etag(self, query_string: str) -> str:
+        # 同一份目录，不同的查询参数（搜索、分页）返回的内容不同
+        digest = hashlib.sha1(f'{self.version}?{query_string}'.encode(CONST.CODE_UTF8)).hexdigest()
+        return f'W/"{digest[:20]}"'
+
+
+course_catalogue_cache = AsyncTTLCache(maxsize=1, ttl=SETTING.COURSE_CACHE_TTL)
+
+
+async def get_course_catalogue() -> CourseCatalogue:
+    """
+    课程目录走进程内缓存，并发回源只查一次库。其他worker的修改在TTL内生效
+    """
+    return await course_catalogue_cache.get_or_load('catalogue', _load_course_catalogue)
+
+
+async def _load_course_catalogue() -> CourseCatalogue:
+    return CourseCatalogue(await CourseModel.all().order_by('-id'))
+
+
+def invalidate_course_catalogue():
+    course_catalogue_cache.clear()
 
 
-async def find_courses(request) -> dict:
+def find_courses(request, catalogue: CourseCatalogue) -> dict:
     """
-    课程列表
+    课程列表（在课程目录快照上过滤、分页）
     """
     _id: str = request.args.get(CONST.ID)
     search: str = request.args.get(CONST.SEARCH)
-    query = CourseModel.filter()
+    items = catalogue.items
     if _id:
-        query = query.filter(id=_id)
+        items = [item for item in items if str(item[CONST.ID]) == _id]
     elif search:
-        query = query.filter(name__icontains=search)
+        search = search.lower()
+        items = [item for item in items if search in item[CONST.NAME].lower()]
 
-    return await paging(request, query)
+    return list_paging(request, items)
 
     # search: str = request.args.get(CONST.SEARCH)
     # query = CourseModel.filter()
@@ -26,5 +70,4 @@ async def find_courses(request) -> dict:
 
 
 async def pk_thumbnail_map() -> dict:
-    courses = await CourseModel.all()
-    return {course.id: course.thumbnail for course in courses}
+    return (await get_course_catalogue()).thumbnails
@@ -1,15 +1,18 @@
 import re
 import typing
+from collections import defaultdict
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, timedelta
-from tortoise.expressions import Q
+from tortoise import timezone
+from tortoise.expressions import F, Q, RawSQL
+from tortoise.queryset import QuerySet
+from tortoise.transactions import in_transaction
 
 from api import paging
 from common.const import CONST
-from common.enum import StaffRoleEnum
-from infra.utils import page_num_size
-from orm.model import ExpenseModel, UserModel
-from orm.order_orm import order_amount_avg
+from common.enum import StaffRoleEnum, ExpenseStatusEnum
+from infra.utils import is_first_page
+from orm.model import ExpenseModel, UserModel, OrderModel
 
 
 async def my_expenses(request) -> dict:
@@ -80,11 +83,63 @@ async def find_expenses(request) -> dict:
         query = query.filter(create_time__lt=(create_date_end + timedelta(days=1)).strftime(date_format))  # 要加一天
 
     pagination = await paging(request, query)
-    page_num, _ = page_num_size(request)
-    if page_num == 1:
-        order_cnt_dict = await ExpenseModel.count_via_group_by(query, 'order_no')
-        order_avg_dict: typing.Dict[str, Decimal] = await order_amount_avg()
-        order_total_amount = sum([order_avg_dict.get(k) * Decimal(v) for k, v in order_cnt_dict.items()])
-        order_total_amount = float(order_total_amount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)) if order_total_amount else 0
-        pagination['amount'] = order_total_amount
+    if is_first_page(request):
+        pagination['amount'] = await expense_amount_sum(query)
     return pagination
+
+
+async def expense_amount_sum(query: QuerySet) -> float:
+    """
+    核销记录折算金额：每条核销按其订单的 amount/limit_counts 计价，在数据库里关联order表按order_no求和，
+    开销只跟过滤后的核销记录数有关
+    """
+    result = await query.annotate(expense_amount=RawSQL(
+        "SUM((SELECT CAST(`order`.`amount` AS DECIMAL(20, 8)) / `order`.`limit_counts` FROM `order` "
+        "WHERE `order`.`order_no` = `expense`.`order_no` AND `order`.`limit_counts` > 0))"
+    )).values('expense_amount')
+    total_amount = (result[0].get('expense_amount') or 0) if result else 0
+    return float(Decimal(total_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)) if total_amount else 0
+
+
+def surplus_delta(current_status: ExpenseStatusEnum, target_status: ExpenseStatusEnum) -> int:
+    """
+    核销记录状态变更对订单剩余次数的影响
+    """
+    if target_status in (ExpenseStatusEnum.FREE, ExpenseStatusEnum.REJECT):
+        if current_status in (ExpenseStatusEnum.PENDING, ExpenseStatusEnum.ACTIVATED):  # 返还课时
+            return 1
+    if target_status == ExpenseStatusEnum.ACTIVATED:
+        if current_status in (ExpenseStatusEnum.REJECT, ExpenseStatusEnum.FREE):  # 扣除课时
+            return -1
+    return 0
+
+
+async def review_expenses(ids: typing.List[int], target_status: str) -> int:
+    """
+    店主/管理员审核核销记录（支持批量）。状态变更与订单课时的返还/扣除在同一个事务里，课时用数据库端加减，
+    变化量相同的订单合并成一条UPDATE。返回处理的核销记录数
+    """
+    target_status = ExpenseStatusEnum(target_status)
+    async with in_transaction():
+        expenses: typing.List[ExpenseModel] = await ExpenseModel.filter(id__in=ids).select_for_update() \
+            .only('id', 'status', 'order_no')
+        if not expenses:
+            return 0
+
+        order_deltas: typing.Dict[str, int] = defaultdict(int)
+        for expense in expenses:
+            order_deltas[expense.order_no] += surplus_delta(ExpenseStatusEnum(expense.status), target_status)
+
+        now = timezone.now()
+        await ExpenseModel.filter(id__in=[expense.id for expense in expenses]) \
+            .update(status=target_status.value, update_time=now)
+
+        delta_orders: typing.Dict[int, typing.List[str]] = defaultdict(list)
+        for order_no, delta in order_deltas.items():
+            if delta:
+                delta_orders[delta].append(order_no)
+        for delta, order_nos in delta_orders.items():
+            await OrderModel.filter(order_no__in=order_nos) \
+                .update(surplus_counts=F('surplus_counts') + delta, update_time=now)
+
+    return len(expenses)
@@ -4,12 +4,15 @@ from datetime import datetime
 from tortoise.models import Model
 from tortoise.queryset import QuerySet
 from tortoise.functions import Count
-from tortoise import fields
+from tortoise import fields, timezone
 from enum import Enum
 
 from common.const import CONST
 from common.enum import BillTypeEnum, OrderStatusEnum, ExpenseStatusEnum
+from infra.cache import AsyncTTLCache
 from infra.date_utils import get_date_time_str, get_date_str
+from infra.utils import NotFoundError
+from settings.setting import SETTING
 
 
 class BaseModel(Model):
@@ -25,21 +28,50 @@ class BaseModel(Model):
     @classmethod
     async def get_one(cls, **kwargs) -> T:
         obj = await cls.get_or_none(**kwargs)
-        assert obj, f"{cls.__name__}[{kwargs.popitem()}] not found"
+        if not obj:
+            raise NotFoundError(f"{cls.__name__}[{kwargs.popitem()}] not found")
         return obj
 
     @classmethod
-    async def update_one(cls, data: dict) -> T:
+    async def update_one(cls, data: dict, fetch: bool = True) -> typing.Union[T, int]:
+        """
+        按id局部更新值不为None的字段，只发一条`UPDATE ... SET <变更字段>`。
+        fetch=False时不查询记录，直接按主键更新并返回影响行数
+        """
         _id = data.pop(CONST.ID)
         assert _id, "miss model pk"
-        obj = await cls.get_one(id=_id)
+        update_data = {k: v for k, v in data.items() if v is not None and k in cls._meta.fields_map}
+
+        if not fetch:
+            if not update_data:
+                return 0
+            return await cls.filter(id=_id).update(**update_data, update_time=timezone.now())
 
-        for k, v in data.items():
-            if v is not None:
+        obj = await cls.get_one(id=_id)
+        if update_data:
+            for k, v in update_data.items():
                 obj.__setattr__(k, v)
-                await obj.save()
+            await obj.save(update_fields=[*update_data, 'update_time'])
         return obj
 
+    @classmethod
+    async def get_many(cls, ids: typing.Iterable[int], fields: typing.Sequence[str] = None,
+                       chunk_size: int = 500) -> dict[int, T]:
+        """
+        按id批量查询，每chunk_size个id一条`IN (...)`，fields指定时只查这些列（总会带上id），返回id->对象。
+        只查部分列的对象不能直接save，更新请按id走update_one/filter().update()
+        """
+        ids = list(dict.fromkeys(ids))
+        only = (CONST.ID, *(f for f in fields if f != CONST.ID)) if fields else None
+        objs = dict()
+        for i in range(0, len(ids), chunk_size):
+            query = cls.filter(id__in=ids[i:i + chunk_size])
+            if only:
+                query = query.only(*only)
+            for obj in await query:
+                objs[obj.id] = obj
+        return objs
+
     @classmethod
     async def delete_one(cls, _id: int):
         obj = await cls.get_one(id=_id)
@@ -52,8 +84,11 @@ class BaseModel(Model):
         return {entry[group_by]: entry['count'] for entry in bill_type_counts}
 
     def to_dict(self, *field) -> dict:
+        if not field:
+            return _get_serializer(self.__class__)(self)
+
         d = dict()
-        for c in field or self._meta.fields:
+        for c in field:
             attr_name = c if isinstance(c, str) else c.name
             value = getattr(self, attr_name)
             if isinstance(value, datetime):
@@ -66,6 +101,47 @@ class BaseModel(Model):
             d[attr_name] = value
         return d
 
+    @classmethod
+    def to_dicts(cls, objs: typing.Iterable[T]) -> list[dict]:
+        """
+        批量序列化，整页数据共用同一个编译好的序列化函数
+        """
+        serialize = _get_serializer(cls)
+        return [serialize(obj) for obj in objs]
+
+
+_serializers: dict[type, typing.Callable[[BaseModel], dict]] = {}  # model类 -> 编译好的序列化函数
+
+
+def _get_serializer(model_cls: typing.Type[BaseModel]) -> typing.Callable[[BaseModel], dict]:
+    serializer = _serializers.get(model_cls)
+    if serializer is None:
+        serializer = _serializers[model_cls] = _compile_serializer(model_cls)
+    return serializer
+
+
+def _compile_serializer(model_cls: typing.Type[BaseModel]) -> typing.Callable[[BaseModel], dict]:
+    """
+    按model的字段生成专用的序列化函数（一次属性读取 + 一个dict字面量），
+    时间字段的格式（expire_time只取日期）和枚举取值在生成时就确定，不用每个对象每个字段都判断
+    """
+    assigns, items = [], []
+    for i, (name, field) in enumerate(model_cls._meta.fields_map.items()):
+        if isinstance(field, fields.DatetimeField):
+            width = 10 if name == 'expire_time' else 19  # 等价于CONST.DATE_FORMAT / CONST.DATETIME_FORMAT
+            assigns.append(f"    v{i} = obj.{name}")
+            items.append(f"{name!r}: v{i}.isoformat(' ', 'seconds')[:{width}] if isinstance(v{i}, datetime) else v{i}")
+        elif isinstance(field, (fields.data.CharEnumFieldInstance, fields.data.IntEnumFieldInstance)):
+            assigns.append(f"    v{i} = obj.{name}")
+            items.append(f"{name!r}: v{i}.value if isinstance(v{i}, Enum) else v{i}")
+        else:
+            items.append(f"{name!r}: obj.{name}")
+
+    source = "def serialize(obj):\n" + "\n".join(assigns) + "\n    return {" + ", ".join(items) + "}\n"
+    namespace = {'datetime': datetime, 'Enum': Enum}
+    exec(compile(source, f"<{model_cls.__name__}.serializer>", 'exec'), namespace)
+    return namespace['serialize']
+
 
 class UserModel(BaseModel):
     class Meta:
@@ -81,6 +157,28 @@ class UserModel(BaseModel):
     staff_roles = fields.JSONField(description="账号权限列表", default=[])
     comments = fields.JSONField(description="备注", default=[])
 
+    @classmethod
+    async def get_via_openid(cls, openid: str) -> typing.Optional['UserModel']:
+        """
+        请求中间件识别用户身份用，优先走缓存（未注册的openid也会缓存为None）
+        """
+        return await user_identity_cache.get_or_load(openid, lambda: cls.get_or_none(openid=openid))
+
+    @classmethod
+    async def update_one(cls, data: dict, fetch: bool = True) -> typing.Union['UserModel', int]:
+        _id = data.get(CONST.ID)
+        result = await super().update_one(data, fetch=fetch)
+        if fetch:
+            user_identity_cache.invalidate(result.openid)
+        else:
+            user_identity_cache.invalidate_by(_id)
+        return result
+
+
+# 按openid缓存，按用户id建索引；本进程内修改立即失效，其他worker的修改在USER_CACHE_TTL内生效
+user_identity_cache = AsyncTTLCache(maxsize=SETTING.USER_CACHE_SIZE, ttl=SETTING.USER_CACHE_TTL,
+                                    index_of=lambda user: user.id)
+
 
 class CourseModel(BaseModel):
     class Meta:
@@ -103,6 +201,9 @@ class CourseModel(BaseModel):
 class OrderModel(BaseModel):
     class Meta:
         table = "order"
+        # 到期提醒任务按这三列筛选。项目不跑generate_schemas，已有的库需手动建索引（索引名与Tortoise生成的一致）：
+        # CREATE INDEX `idx_order_notifie_c9837c` ON `order` (`notified`, `status`, `expire_time`);
+        indexes = (("notified", "status", "expire_time"),)
 
     member_id = fields.IntField(description="会员编号ID")
     member_name = fields.CharField(max_length=255, description="会员名")
@@ -1,14 +1,13 @@
 import re
-import typing
-from decimal import Decimal
 from datetime import datetime, timedelta
 
+from tortoise import timezone
 from tortoise.functions import Sum
 from tortoise.queryset import Q
 
 from api import paging
 from common.const import CONST
-from infra.utils import page_num_size
+from infra.utils import is_first_page
 from orm.course_orm import pk_thumbnail_map
 from orm.model import OrderModel, UserModel
 
@@ -86,16 +85,17 @@ async def find_orders(request) -> dict:
         query = query.filter(create_time__lt=(create_date_end + timedelta(days=1)).strftime(date_format))  # 要加一天
 
     pagination = await paging(request, query)
-    page_num, _ = page_num_size(request)
-    if page_num == 1:
+    if is_first_page(request):
         total_amount_result = await query.annotate(total_amount=Sum('amount')).values('total_amount')
         total_amount = (total_amount_result[0].get('total_amount') or 0) if total_amount_result else 0
         pagination['amount'] = total_amount
     return pagination
 
 
-async def order_amount_avg() -> typing.Dict[str, Decimal]:
-    orders: typing.List[dict] = await OrderModel.all().values('order_no', 'limit_counts', 'amount')
-
-    return {order.get('order_no'): Decimal(order.get('amount') / order.get('limit_counts')) if order.get(
-        'limit_counts') else Decimal(0) for order in orders}
+async def mark_orders_notified(order_ids: list[int]) -> int:
+    """
+    到期提醒发送成功后，一条UPDATE批量标记已提醒
+    """
+    if not order_ids:
+        return 0
+    return await OrderModel.filter(id__in=order_ids).update(notified=CONST.TRUE_STATUS, update_time=timezone.now())
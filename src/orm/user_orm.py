@@ -1,14 +1,15 @@
-import typing
 from functools import reduce
 
-from tortoise.expressions import RawSQL
+from tortoise import timezone
+from tortoise.expressions import RawSQL, F
 from tortoise.queryset import Q
 
 from api import paging
 from common.const import CONST
 from common.enum import StaffRoleEnum
+from infra.utils import ForbiddenError
 from loggers.logger import logger
-from orm.model import UserModel, OrderModel, ExpenseModel
+from orm.model import UserModel, OrderModel, ExpenseModel, user_identity_cache
 
 
 async def find_users(request) -> dict:
@@ -55,7 +56,8 @@ async def update_user(request):
     user: UserModel = await UserModel.get_one(id=data[CONST.ID])
     user_role = max(user.staff_roles) if user.staff_roles else 0
 
-    assert user_role < current_user_role, f"UserModel[{user.id}] no access for user[{current_user.id}]"
+    if user_role >= current_user_role:
+        raise ForbiddenError(f"UserModel[{user.id}] no access for user[{current_user.id}]")
 
     need_update = False
     cascade = False
@@ -64,7 +66,8 @@ async def update_user(request):
     staff_roles = data.get(CONST.STAFF_ROLES)
     if staff_roles is not None:
         imparted_role = max(staff_roles) if staff_roles else 0
-        assert imparted_role < current_user_role, f"no access to grant higher role via user[{current_user.id}]"
+        if imparted_role >= current_user_role:
+            raise ForbiddenError(f"no access to grant higher role via user[{current_user.id}]")
         need_update = True
     else:
         data.pop(CONST.STAFF_ROLES, None)
@@ -113,6 +116,15 @@ async def update_user(request):
                         f"cascade update: {modified_order_cnt} order / {modified_expense_cnt} expense")
 
 
-async def identifier_user_map(identifier: str = 'id') -> typing.Dict[str, UserModel]:
-    users = await UserModel.all()
-    return {getattr(user, identifier): user for user in users}
+async def consume_subscribe_counts(sent_ids: list[int], refused_ids: list[int]):
+    """
+    订阅消息发送后批量回写：发送成功的subscribe_counts-1（不小于0），被拒收的置0
+    """
+    now = timezone.now()
+    if sent_ids:
+        await UserModel.filter(id__in=sent_ids, subscribe_counts__gt=0) \
+            .update(subscribe_counts=F(CONST.SUBSCRIBE_COUNTS) - 1, update_time=now)
+    if refused_ids:
+        await UserModel.filter(id__in=refused_ids).update(subscribe_counts=0, update_time=now)
+
+    user_identity_cache.invalidate_by(*sent_ids, *refused_ids)
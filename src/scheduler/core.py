@@ -1,6 +1,8 @@
 # -*- coding:utf-8 -*-
+import asyncio
 import os
 import traceback
+from functools import wraps
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler import events
@@ -17,9 +19,22 @@ class _Scheduler:
         }
 
         self.aps = None
+        self._running: set[asyncio.Task] = set()  # 正在执行的job，停止时等它们结束
 
-    def add_job(self, *arg, **kw):
-        self.aps.add_job(*arg, **kw)
+    def add_job(self, func, *arg, **kw):
+        self.aps.add_job(self._track(func), *arg, **kw)
+
+    def _track(self, func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            task = asyncio.current_task()
+            self._running.add(task)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self._running.discard(task)
+
+        return wrapper
 
     def run(self, loop):
         logger.info("Start Apscheduler. " + f'bound event_loop at PID[{os.getpid()}]' if loop else '')
@@ -30,8 +45,19 @@ class _Scheduler:
             events.EVENT_JOB_ERROR)
         self.aps.start()
 
-    def stop(self):
-        self.aps.shutdown()
+    async def stop(self):
+        """
+        先暂停（不再触发新的job），等正在执行的job结束后再关闭。
+        AsyncIOScheduler的shutdown会直接取消执行中的协程job，任务做到一半被打断
+        """
+        if self.aps is None or not self.aps.running:
+            return
+        scheduler, self.aps = self.aps, None
+        scheduler.pause()
+        if self._running:
+            logger.info(f"Apscheduler waiting for {len(self._running)} running job(s)...")
+            await asyncio.wait(set(self._running))  # 不用gather，外层被取消时不连带取消job
+        scheduler.shutdown(wait=False)
         logger.info("Apscheduler shutdown.")
 
 
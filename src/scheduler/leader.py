@@ -0,0 +1,93 @@
+import asyncio
+import os
+import typing
+
+import aiomysql
+
+from loggers.logger import logger
+
+
+class SchedulerLeader:
+    """
+    多worker部署时只让一个进程跑定时任务：各worker用独立的MySQL连接抢`GET_LOCK`，
+    抢到的成为leader并启动调度器。锁跟着连接走，leader进程退出或连接断开时MySQL自动释放，
+    其他worker在下一次检查时接管（故障切换最多延迟一个interval）
+    """
+
+    def __init__(self, credentials: dict, lock_name: str, interval: float = 15,
+                 on_elected: typing.Callable[[], typing.Awaitable] = None,
+                 on_demoted: typing.Callable[[], typing.Awaitable] = None):
+        self.credentials = credentials
+        self.lock_name = lock_name
+        self.interval = interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_leader = False
+        self._conn: typing.Optional[aiomysql.Connection] = None
+        self._task: typing.Optional[asyncio.Task] = None
+
+    async def _execute(self, sql: str, *args):
+        if self._conn is None or self._conn.closed:
+            self._conn = await aiomysql.connect(host=self.credentials['host'], port=int(self.credentials['port']),
+                                                user=self.credentials['user'], password=self.credentials['password'],
+                                                db=self.credentials['database'], autocommit=True)
+        async with self._conn.cursor() as cursor:
+            await cursor.execute(sql, args)
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def _check(self):
+        if self.is_leader:
+            # 定期确认锁还在自己的连接上，同时起到连接保活的作用
+            if await self._execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", self.lock_name) == 1:
+                return
+            await self._demote('lock lost')
+        elif await self._execute("SELECT GET_LOCK(%s, 0)", self.lock_name) == 1:
+            self.is_leader = True
+            logger.warning(f'Scheduler leader elected at PID[{os.getpid()}]')
+            if self.on_elected:
+                await self.on_elected()
+
+    async def _demote(self, reason: str):
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        logger.warning(f'Scheduler leader demoted at PID[{os.getpid()}], {reason}')
+        if self.on_demoted:
+            await self.on_demoted()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._check()
+            except Exception as e:
+                # 连接断了锁也就没了，先卸任，下一轮重连后重新抢锁
+                logger.error(f'Scheduler leader check failed, {e.__class__.__name__}<{str(e)}>')
+                self._close_conn()
+                await self._demote('connection lost')
+            await asyncio.sleep(self.interval)
+
+    def _close_conn(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            # 先卸任（等正在执行的任务结束）再释放锁，否则其他worker抢到锁后会和这里的任务重叠执行
+            await self._demote('server stop')
+            try:
+                await self._execute("SELECT RELEASE_LOCK(%s)", self.lock_name)
+            except Exception as e:
+                logger.error(f'Scheduler leader release failed, {e.__class__.__name__}<{str(e)}>')
+        self._close_conn()
@@ -1,14 +1,19 @@
-import pytz
+import time
 import typing
 from datetime import datetime, timedelta
 
+import pytz
+from tortoise.queryset import Q
+
 from common.const import CONST
 from common.enum import OrderStatusEnum, BillTypeEnum
 from loggers.logger import logger
 from orm.model import OrderModel, UserModel
-from orm.user_orm import identifier_user_map
+from orm.order_orm import mark_orders_notified
+from orm.user_orm import consume_subscribe_counts
 from scheduler.core import aps
-from service.wx_openapi import subscribe_send
+from service.subscribe_dispatcher import SubscribeDispatcher, SubscribeMessage
+from settings.setting import SETTING
 
 
 async def expire_order():
@@ -19,30 +24,43 @@ async def expire_order():
         logger.info(f"{modified_count}'s Order expired")
 
 
-async def order_notice():
+async def notice_candidates(now_dt: datetime, chunk_size: int = 500) -> typing.AsyncIterator[OrderModel]:
     """
+    按id升序分批取出需要提醒的订单（筛选在SQL里完成，走(notified, status, expire_time)索引）：
     1. 没有提醒过，且状态=active的订单
-    2. 今日+四天 > expire_time 或者 剩余三次
+    2. 计时卡3天内过期，或者计次卡剩余不超过2次
     """
-    now_dt = datetime.now(pytz.timezone('Asia/Shanghai'))
-    query = await OrderModel.filter(
+    query = OrderModel.filter(
         notified=CONST.FALSE_STATUS, status=OrderStatusEnum.ACTIVATED.value
-    ).all()
+    ).filter(
+        Q(bill_type=BillTypeEnum.DAY.value, expire_time__lt=now_dt + timedelta(days=3)) |
+        Q(bill_type=BillTypeEnum.COUNT.value, surplus_counts__lte=2)
+    )
+
+    last_id = 0
+    while True:
+        orders = await query.filter(id__gt=last_id).order_by('id').limit(chunk_size)
+        for order in orders:
+            yield order
+        if len(orders) < chunk_size:
+            return
+        last_id = orders[-1].id
+
+
+async def order_notice():
+    """
+    到期提醒：计时卡3天内过期，或者计次卡剩余不超过2次
+    """
+    now_dt = datetime.now(pytz.timezone('Asia/Shanghai'))
 
     # 单人多个订单即将过期，只提醒一次且用老订单的信息：剩余x课时（x天后过期）、课程名、下单日期、订单编号。
     user_notice_dict = {}
-    for order in query:
-        order: OrderModel
-
-        if order.bill_type == BillTypeEnum.DAY and order.expire_time < (now_dt + timedelta(days=3)):
+    async for order in notice_candidates(now_dt):
+        if order.bill_type == BillTypeEnum.DAY:
             delta_days = (order.expire_time - now_dt).days + 1
             phrase1 = '今日过期' if delta_days == 1 else f'{delta_days}天后过期'
-
-        elif order.bill_type == BillTypeEnum.COUNT and order.limit_counts <= 2:
-            phrase1 = f'剩余{order.limit_counts}课时'
-
         else:
-            continue
+            phrase1 = f'剩余{order.surplus_counts}课时'
 
         if order.member_id in user_notice_dict:
             logger.warning(
@@ -50,7 +68,7 @@ async def order_notice():
                 f' {phrase1} will continue.')
 
         user_notice_dict.setdefault(order.member_id, {
-            "order_ids": [order.id],  # 下面会pop出来，为了更新单人的多订单
+            "order_ids": [],  # 下面会pop出来，为了更新单人的多订单
             "member_name": order.member_name,  # 下面会pop出来，只为了日志输出
             "phrase1": {
                 "value": phrase1
@@ -69,37 +87,52 @@ async def order_notice():
     if not user_notice_dict:
         return
 
-    user_map: typing.Dict[str, UserModel] = await identifier_user_map()
+    # 只查需要提醒的会员，且只取发送用到的列
+    user_map = await UserModel.get_many(user_notice_dict, fields=(CONST.OPENID, CONST.SUBSCRIBE_COUNTS))
 
-    # 开始发送
+    messages, log_prefixes, skipped = [], {}, 0
     for member_id, data in user_notice_dict.items():
         member_name = data.pop('member_name')
-        log_prefix = f'prepare notice {member_name}, with {data}'
-        order_ids = data.pop('order_ids')
+        log_prefixes[member_id] = f'prepare notice {member_name}, with {data}'
 
         member = user_map.get(member_id)
+        if member is None:
+            logger.warning(log_prefixes[member_id] + ', member not found.')
+            skipped += 1
+            continue
         if member.subscribe_counts <= 0:
-            logger.warning(log_prefix + ', no surplus subscribe_counts.')
+            logger.warning(log_prefixes[member_id] + ', no surplus subscribe_counts.')
+            skipped += 1
             continue
 
-        try:
-            res = subscribe_send(member.openid, CONST.ORDER_STATUS_TEMPLATE, data)
-        except Exception as e:
-            logger.error(log_prefix + f', subscribe send exec, {e.__class__.__name__}<{str(e)}>')
+        payload = {k: v for k, v in data.items() if k != 'order_ids'}
+        messages.append(SubscribeMessage(member_id, member.openid, CONST.ORDER_STATUS_TEMPLATE, payload))
+
+    # 开始发送（并发+限速），结果统一批量回写
+    start = time.monotonic()
+    results = await SubscribeDispatcher(SETTING.SUBSCRIBE_CONCURRENCY, SETTING.SUBSCRIBE_RPS).dispatch(messages)
+    elapsed = time.monotonic() - start
+
+    sent_ids, refused_ids, failed_ids = [], [], []
+    for member_id, res in results.items():
+        if res:
+            logger.info(log_prefixes[member_id] + ', success.')
+            sent_ids.append(member_id)
+        elif res is False:
+            logger.error(log_prefixes[member_id] + ', refuse')
+            refused_ids.append(member_id)
         else:
-            if res:
-                logger.info(log_prefix + f', success.')
-                for order_id in order_ids:
-                    await OrderModel.update_one({CONST.ID: order_id, CONST.NOTIFIED: CONST.TRUE_STATUS})
-            else:
-                logger.error(log_prefix + f', refuse')
-
-            # 成功则subscribe_counts-1，被拒绝则将subscribe_counts置0
-            member_data = {
-                CONST.ID: member_id,
-                CONST.SUBSCRIBE_COUNTS: max(member.subscribe_counts - 1, 0) if res else 0
-            }
-            await UserModel.update_one(member_data)
+            failed_ids.append(member_id)
+
+    # 成功则订单标记已提醒、subscribe_counts-1，被拒绝则将subscribe_counts置0，发送异常的下次再提醒
+    notified_count = await mark_orders_notified(
+        [order_id for member_id in sent_ids for order_id in user_notice_dict[member_id]['order_ids']])
+    await consume_subscribe_counts(sent_ids, refused_ids)
+
+    logger.info(f'order notice finished: {len(messages)} messages in {elapsed:.2f}s '
+                f'({len(messages) / elapsed if elapsed else 0:.1f}/s), success {len(sent_ids)}, '
+                f'refused {len(refused_ids)}, failed {len(failed_ids)}, skipped {skipped}, '
+                f'{notified_count} orders notified')
 
 
 async def run_tasks():
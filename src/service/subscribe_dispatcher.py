@@ -0,0 +1,50 @@
+import asyncio
+import time
+import typing
+
+from loggers.logger import logger
+from service.wx_openapi import subscribe_send
+
+
+class SubscribeMessage(typing.NamedTuple):
+    key: typing.Hashable  # 调用方用来对应结果，如会员id
+    openid: str
+    template_id: str
+    data: dict
+
+
+DispatchResults = typing.Dict[typing.Hashable, typing.Optional[bool]]  # SubscribeMessage.key -> 发送结果
+
+
+class SubscribeDispatcher:
+    """
+    订阅消息并发发送：信号量限制同时在途的请求数，按rps均匀放行（不超过微信接口配额）。
+    发送结果：True成功，False用户拒收，None发送异常
+    """
+
+    def __init__(self, concurrency: int = 8, rps: int = 20):
+        self.concurrency = max(concurrency, 1)
+        self.interval = 1 / rps if rps > 0 else 0
+        self._next_slot = 0.0
+
+    async def _pace(self):
+        # 单线程事件循环里读写_next_slot之间没有await，不需要加锁
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send(self, semaphore: asyncio.Semaphore, message: SubscribeMessage) -> typing.Optional[bool]:
+        async with semaphore:
+            await self._pace()
+            try:
+                return await subscribe_send(message.openid, message.template_id, message.data)
+            except Exception as e:
+                logger.error(f'subscribe send {message.key} exec, {e.__class__.__name__}<{str(e)}>')
+                return None
+
+    async def dispatch(self, messages: typing.List[SubscribeMessage]) -> DispatchResults:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._send(semaphore, message) for message in messages))
+        return {message.key: result for message, result in zip(messages, results)}
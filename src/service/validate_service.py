@@ -3,11 +3,13 @@ import re
 import typing
 from datetime import datetime
 
-from jsonschema import validate, ValidationError, SchemaError
+from jsonschema import ValidationError, SchemaError
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 
 from common.const import CONST
 from common.enum import BillTypeEnum, OrderStatusEnum, StaffRoleEnum, ExpenseStatusEnum, ScanSceneEnum
-from loggers.logger import logger
+from loggers.logger import logger, client_error_log
 from service.wx_openapi import phone_via_code
 
 userprofile_update_schema = {
@@ -139,6 +141,15 @@ course_create_schema = {
     ]
 }
 
+course_update_schema = copy.deepcopy(course_create_schema)
+course_update_schema['properties']['id'] = {
+    "type": "integer",
+    "title": "ID 编号",
+    "minimum": 1,
+}
+course_update_schema['required'] = ['id']
+course_update_schema['minProperties'] = 2
+
 order_create_schema = {
     "type": "object",
     "properties": {
@@ -288,6 +299,28 @@ expense_update_schema = {
     ]
 }
 
+expense_batch_update_schema = {
+    "type": "object",
+    "properties": {
+        "ids": {
+            "type": "array",
+            "title": "ID 编号列表",
+            "items": {
+                "type": "integer",
+                "minimum": 1
+            },
+            "minItems": 1,
+            "maxItems": 500,
+            "uniqueItems": True
+        },
+        "status": expense_update_schema["properties"]["status"]
+    },
+    "required": [
+        "ids",
+        "status"
+    ]
+}
+
 qrcode_create_schema = {
     "type": "object",
     "properties": {
@@ -343,13 +376,13 @@ def validate_order_expense_get_args(request,
     return True, None
 
 
-def validate_userprofile_update_data(data: dict) -> typing.Tuple[bool, str]:
+async def validate_userprofile_update_data(data: dict) -> typing.Tuple[bool, str]:
     rst, err_msg = __validate_data(data, userprofile_update_schema)
     if not rst:
         return rst, err_msg
 
     if data.get('phone') and not re.match(r'^1\d{10}$', data.get('phone')):  # FIXME 手机号正则可能有问题
-        data['phone'] = phone_via_code(data.get('phone'))  # 用code置换手机号
+        data['phone'] = await phone_via_code(data.get('phone'))  # 用code置换手机号
 
     return True, ''
 
@@ -376,14 +409,6 @@ def validate_course_create_data(data: dict) -> typing.Tuple[bool, str]:
 
 
 def validate_course_update_data(data: dict) -> typing.Tuple[bool, str]:
-    course_update_schema = copy.deepcopy(course_create_schema)
-    course_update_schema['properties']['id'] = {
-        "type": "integer",
-        "title": "ID 编号",
-        "minimum": 1,
-    }
-    course_update_schema['required'] = ['id']
-    course_update_schema['minProperties'] = 2
     # 下面与新增时一致
     rst, err_msg = __validate_data(data, course_update_schema)
     if not rst:
@@ -426,6 +451,10 @@ def validate_expense_update_data(data: dict) -> typing.Tuple[bool, str]:
     return __validate_data(data, expense_update_schema)
 
 
+def validate_expense_batch_update_data(data: dict) -> typing.Tuple[bool, str]:
+    return __validate_data(data, expense_batch_update_schema)
+
+
 def validate_qrcode_create_data(data: dict) -> typing.Tuple[bool, str]:
     return __validate_data(data, qrcode_create_schema)
 
@@ -478,17 +507,32 @@ def __parse_error_msg(e: ValidationError, schema: dict):
     return err_msg
 
 
+__validators = {}  # id(schema) -> 编译好的validator，schema都是模块级常量，只在第一次使用时检查并编译
+
+
+def __get_validator(schema: dict):
+    validator = __validators.get(id(schema))
+    if validator is None:
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        validator = __validators[id(schema)] = cls(schema)
+    return validator
+
+
 def __validate_data(data: dict, schema: dict) -> typing.Tuple[bool, str]:
     rst = True
     err_msg = ''
     try:
-        validate(data, schema)
+        # 与jsonschema.validate()一致，取best_match的错误
+        error = best_match(__get_validator(schema).iter_errors(data))
+        if error is not None:
+            raise error
     except SchemaError as e:
         logger.exception("schema invalid:{}".format(str(e)))
         rst, err_msg = False, e.message
 
     except ValidationError as e:
-        logger.exception("validate error:{}".format(e.message))
+        client_error_log('ValidationError', "validate error:{}".format(e.message))
         e.schema_path.insert(-1, CONST.ERR_MSG)
         rst, err_msg = False, __parse_error_msg(e, schema) or e.message
 
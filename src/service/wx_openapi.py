@@ -1,11 +1,11 @@
-import requests
+import aiohttp
 
 from common.const import CONST
-from infra.utils import requests_retry
+from infra.http_client import http_client
 from loggers.logger import logger
 
 
-def phone_via_code(code: str) -> str:
+async def phone_via_code(code: str) -> str:
     """
     {
         "errcode": 0,
@@ -21,16 +21,16 @@ def phone_via_code(code: str) -> str:
         }
     }
     """
-    response: requests.Response = requests_retry(
+    response: aiohttp.ClientResponse = await http_client.request(
         'post', 'http://api.weixin.qq.com/wxa/business/getuserphonenumber',
         json={'code': code}
     )
-    resp_dict = response.json()
+    resp_dict = await response.json(content_type=None)
     assert resp_dict.get('phone_info', {}).get('phoneNumber'), str(resp_dict)
     return resp_dict.get('phone_info', {}).get('phoneNumber')
 
 
-def subscribe_send(openid: str, template_id: str, template_data: dict) -> bool:
+async def subscribe_send(openid: str, template_id: str, template_data: dict) -> bool:
     """
     reference: https://developers.weixin.qq.com/miniprogram/dev/OpenApiDoc/mp-message-management/subscribe-message/sendMessage.html
     """
@@ -78,12 +78,12 @@ def subscribe_send(openid: str, template_id: str, template_data: dict) -> bool:
     #     response.headers = {'Content-Type': 'application/json'}
     #     response._content = json.dumps({'errcode': 0, 'errmsg': 'ok'}).encode()
 
-    response: requests.Response = requests_retry(
+    response: aiohttp.ClientResponse = await http_client.request(
         'post', 'http://api.weixin.qq.com/cgi-bin/message/subscribe/send', json=payload
     )
 
     response.raise_for_status()
-    errcode = response.json().get('errcode', -1)
+    errcode = (await response.json(content_type=None)).get('errcode', -1)
     assert errcode in (0, 43101), (f'template={template_id} to {openid} failed, '
-                                   f'Response[{response.status_code}] -> {response.text}')
+                                   f'Response[{response.status}] -> {await response.text()}')
     return False if errcode else True  # 为零发送成功，非零则是用户拒绝订阅消息
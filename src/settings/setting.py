@@ -1,5 +1,6 @@
 import os
 from dataclasses import dataclass, field
+from pathlib import Path
 
 from dotenv import load_dotenv
 
@@ -12,6 +13,29 @@ class _SETTING:
     DEV: bool = field(default=False)
     MYSQL_URI: str = field(default='mysql://*:*@*:*/fitness_db')
     LOG_LEVEL: str = field(default='INFO')
+    LOG_QUEUE_SIZE: int = field(default=10000)  # 日志队列容量，文件/控制台输出在后台线程
+    LOG_QUEUE_POLICY: str = field(default='drop_oldest')  # 日志队列满时：drop_oldest / drop_newest / block
+    LOG_BODY_MAX: int = field(default=512)  # 请求日志里body最多记录的字节数
+    LOG_GET_SAMPLE_RATE: float = field(default=0.0)  # GET请求日志的采样率（0~1），默认不记
+    USER_CACHE_SIZE: int = field(default=4096)  # 用户身份缓存容量（按openid）
+    USER_CACHE_TTL: int = field(default=5)  # 用户身份缓存有效期（秒），也是其他worker改权限后的最长生效延迟
+    HTTP_POOL_SIZE: int = field(default=100)  # 调用微信OpenAPI的连接池大小
+    HTTP_TIMEOUT: int = field(default=10)  # 调用微信OpenAPI的单次超时（秒）
+    QRCODE_WORKERS: int = field(default=2)  # 二维码渲染进程数
+    QRCODE_MAX_PENDING: int = field(default=64)  # 二维码渲染排队上限
+    QRCODE_CACHE_BYTES: int = field(default=16 * 1024 * 1024)  # 二维码内存缓存上限（字节）
+    QRCODE_CACHE_DIR: str = field(default=str(Path.cwd().parent / 'cache' / 'qrcode'))  # 二维码磁盘缓存目录，置空则不用
+    QRCODE_CACHE_DIR_BYTES: int = field(default=256 * 1024 * 1024)  # 二维码磁盘缓存上限（字节），超出按最近使用时间淘汰
+    QRCODE_CACHE_DIR_TTL: int = field(default=7 * 24 * 3600)  # 二维码磁盘缓存多久未使用即删除（秒）
+    LIMITER_BACKEND: str = field(default='memory')  # 限流状态存储：memory（单进程）/ sqlite（多worker共享）
+    LIMITER_SQLITE_PATH: str = field(default=str(Path.cwd().parent / 'cache' / 'limiter.db'))
+    LIMITER_FAIL_OPEN: bool = field(default=True)  # sqlite后端不可用（如锁等待超时）时放行请求，false则按超限拒绝
+    COURSE_CACHE_TTL: int = field(default=5)  # 课程目录缓存有效期（秒），本worker增删改课程时立即重建，其他worker在TTL内生效
+    SUBSCRIBE_CONCURRENCY: int = field(default=8)  # 订阅消息同时在途的请求数
+    SUBSCRIBE_RPS: int = field(default=20)  # 订阅消息每秒最多发送数（微信接口配额）
+    SCHEDULER_LEADER_INTERVAL: int = field(default=15)  # 定时任务leader抢锁/续约检查间隔（秒）
+    METRICS_TOKEN: str = field(default='')  # /metrics的Bearer token，不配置则只在DEV模式下开放
+    DB_QUERY_BUDGET: int = field(default=10)  # 单个请求的SQL条数预算，超出时打印SQL指纹告警
 
     def __post_init__(self):
         for attr, _field in self.__dataclass_fields__.items():  # noqa
@@ -26,6 +50,8 @@ class _SETTING:
             return env_value.lower() in ('true', '1', 'yes')
         elif field_type == int:
             return int(env_value)
+        elif field_type == float:
+            return float(env_value)
         # 添加其他类型转换逻辑（如果需要）
         return env_value
 
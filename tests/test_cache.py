@@ -0,0 +1,44 @@
+import asyncio
+
+from infra.cache import AsyncTTLCache
+
+
+def test_cancelled_caller_does_not_cancel_waiters():
+    async def main():
+        cache = AsyncTTLCache()
+        loads = []
+
+        async def loader():
+            loads.append(1)
+            await asyncio.sleep(0.05)
+            return 'catalogue'
+
+        t1 = asyncio.ensure_future(cache.get_or_load('k', loader))
+        await asyncio.sleep(0)
+        t2 = asyncio.ensure_future(cache.get_or_load('k', loader))
+        await asyncio.sleep(0)
+        t1.cancel()
+
+        assert await t2 == 'catalogue'
+        assert t1.cancelled()
+        assert len(loads) == 1
+        assert cache.get('k') == 'catalogue'  # 第一个调用方取消后回源仍然完成并写入缓存
+
+    asyncio.run(main())
+
+
+def test_loader_error_reaches_all_waiters():
+    async def main():
+        cache = AsyncTTLCache()
+
+        async def loader():
+            await asyncio.sleep(0.01)
+            raise ValueError('db down')
+
+        results = await asyncio.gather(cache.get_or_load('k', loader), cache.get_or_load('k', loader),
+                                       return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert cache.get('k') is None
+        assert not cache._loading
+
+    asyncio.run(main())